@@ -1,8 +1,9 @@
 import asyncio
 from datetime import datetime, timedelta
-import json
 import logging
 import os
+import re
+import time
 
 
 import discord
@@ -11,7 +12,7 @@ from dotenv import load_dotenv
 import pytz
 
 import lol
-from db import get_cursor, get_async_cursor
+from db import get_cursor, get_async_cursor, maintain_rank_partitions
 from dankutil import roman_to_int
 
 load_dotenv()
@@ -21,17 +22,32 @@ DISCORD_TOKEN = os.environ.get("DISCORD_TOKEN")
 intents = discord.Intents.all()
 bot = discord.Bot()
 
-GAME_LOG_CHANNEL_ID = int(os.environ.get("GAME_LOG_CHANNEL_ID"))
-GUILD_ID = int(os.environ.get("GUILD_ID"))
+# Discord allows 10 embeds per message and 6000 characters across them
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+# Upload limit of a guild without boosts, used when the channel can't be looked up
+DEFAULT_UPLOAD_LIMIT_BYTES = 10 * 1024 * 1024
+POST_BATCH_THRESHOLD = int(os.environ.get("POST_BATCH_THRESHOLD", 10))
+# Rows of trimmed matchInfo (a few KB each, see CARD_MATCH_INFO_SQL) loaded at once
+POST_SCAN_BATCH_SIZE = 20
+# Backoff for a channel whose sends keep failing, doubling up to the cap
+CHANNEL_BACKOFF_SECONDS = 60
+CHANNEL_BACKOFF_CAP_SECONDS = 60 * 60
 
 
 class LolCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # channel_id -> (failed sends in a row, monotonic time to retry at)
+        self.channel_backoff = {}
         self.forwardfill_matches.start()
         self.backfill_matches.start()
         self.get_match_details.start()
         self.post_match_details.start()
+        self.maintain_rank_partitions.start()
+        self.aggregate_match_stats.start()
+        if lol.LIVE_GAME_TRACKING:
+            self.track_live_games.start()
 
     @tasks.loop(seconds=120)
     async def forwardfill_matches(self):
@@ -41,23 +57,33 @@ class LolCog(commands.Cog):
     async def backfill_matches(self):
         await asyncio.to_thread(lol.backfill_matches)
 
+    @tasks.loop(seconds=30)
+    async def track_live_games(self):
+        await asyncio.to_thread(lol.track_live_games)
+
     @tasks.loop(seconds=10)
     async def get_match_details(self):
         await asyncio.to_thread(lol.get_match_details)
 
+    @tasks.loop(seconds=60)
+    async def aggregate_match_stats(self):
+        await asyncio.to_thread(lol.aggregate_match_stats)
+
+    @tasks.loop(hours=24)
+    async def maintain_rank_partitions(self):
+        await asyncio.to_thread(maintain_rank_partitions)
+
     @tasks.loop(seconds=60)
     async def post_match_details(self):
         logging.info("Searching for matches to post")
-        channel = self.bot.get_channel(GAME_LOG_CHANNEL_ID)
-        if not channel:
-            return
 
+        # Only the ids are loaded up front, the documents
+        # themselves are streamed in bounded batches below
         async with get_async_cursor() as c:
             await c.execute(
                 """
                 SELECT 
-                    mi.matchId, 
-                    mi.matchInfo
+                    mi.matchId
                 FROM 
                     match_info mi
                 WHERE
@@ -68,87 +94,326 @@ class LolCog(commands.Cog):
                 """
             )
             logging.info(f"Found {c.rowcount} matches to post")
-            matches = await c.fetchall()
+            pending = [matchId for (matchId,) in await c.fetchall()]
+
+        # Catching up after downtime, pack several matches into each message
+        # to stay clear of the per-channel rate limit
+        per_message = 1
+        if len(pending) >= POST_BATCH_THRESHOLD:
+            logging.info(f"Backlog of {len(pending)} matches, posting in batches")
+            per_message = MAX_EMBEDS_PER_MESSAGE
+
+        # Each match is rendered once and fanned out to every channel
+        # of a guild tracking one of its players
+        batches = {}
+        remaining = {}
+        async for matchId, matchInfo, channels in stream_matches(pending):
+            if not channels:
+                await retire_match(matchId)
+                continue
+            # Skip channels backing off until they're due, without building their embeds
+            due = [
+                (guild_id, channel_id)
+                for guild_id, channel_id in channels
+                if self.channel_backoff.get(channel_id, (0, 0))[1] <= time.monotonic()
+            ]
+            if not due:
+                continue
 
-        for matchId, matchInfo in matches:
             logging.info(
-                f"Posting match {matchId} from {datetime.fromtimestamp(matchInfo['info']['gameCreation']/1000)}"
+                f"Posting match {matchId} from {datetime.fromtimestamp(matchInfo['info']['gameCreation']/1000)} to {len(due)} channels"
             )
-            start_time = lol.epoch_to_datetime(matchInfo["info"]["gameCreation"])
-            central_timezone = pytz.timezone("US/Central")
-            start_time = start_time.astimezone(central_timezone)
-            readable_start = start_time.strftime("%B %d, %Y at %I:%M:%S %p %Z")
-            gameDuration = timedelta(seconds=matchInfo["info"]["gameDuration"])
-            embed = discord.Embed(
-                title="MATCH UPDATE!",
-                description=f"Start: {readable_start}\nDuration: {gameDuration}",
-                color=0x00FF00,
+            imagePath = await asyncio.to_thread(
+                lol.MatchImageCreator(matchInfo).get_path
             )
-            gameMap = lol.find_queue_from_id(matchInfo["info"]["queueId"])["map"]
-            queueDescription = lol.find_queue_from_id(matchInfo["info"]["queueId"])[
-                "description"
-            ]
-            embed.add_field(
-                name=gameMap,
-                value=queueDescription,
+            imageSize = os.path.getsize(imagePath)
+            renderedAt = datetime.now()
+            remaining[matchId] = {channel_id for _, channel_id in channels}
+
+            full = []
+            for guild_id, channel_id in due:
+                # Each guild only sees the players it tracks
+                embed = await build_match_embed(matchInfo, guild_id)
+                embed.set_image(url=f"attachment://{os.path.basename(imagePath)}")
+                batch = batches.setdefault(channel_id, [])
+                if batch and (
+                    len(batch) >= per_message
+                    or sum(len(e) for _, e, _, _, _ in batch) + len(embed)
+                    > MAX_EMBED_CHARS_PER_MESSAGE
+                    or sum(size for _, _, _, size, _ in batch) + imageSize
+                    > self.upload_limit(channel_id)
+                ):
+                    full.append((channel_id, batch))
+                    batches[channel_id] = batch = []
+                batch.append((matchId, embed, imagePath, imageSize, renderedAt))
+            await asyncio.gather(
+                *(
+                    self.send_matches(channel_id, batch, remaining)
+                    for channel_id, batch in full
+                )
+            )
+        await asyncio.gather(
+            *(
+                self.send_matches(channel_id, batch, remaining)
+                for channel_id, batch in batches.items()
+                if batch
             )
+        )
 
-            # Example of adding more fields
-            team = ""
-            prev_team = None
-            for participant in matchInfo["info"]["participants"]:
-                discord_id = lol.find_discord_id_from_puuid(participant["puuid"])
-                nameAddon = ""
-                if discord_id:
-                    result = await asyncio.to_thread(
-                        lol.get_summoner_rank, participant["summonerId"]
-                    )
-                    try:
-                        tier, rank = result
-                    except TypeError:
-                        tier, rank = "Unranked", None
-
-                    if not participant["win"]:
-                        # make the embed's color red
-                        embed.color = 0xFF0000
-                    discord_user = await bot.fetch_user(discord_id)
-                    nameAddon = f" ({discord_user.mention})"
-
-                    if participant["teamId"] == 100:
-                        team = "Blue"
-                    elif participant["teamId"] == 200:
-                        team = "Red"
-
-                    if team != prev_team:
-                        if participant["win"]:
-                            name = team + " (WINNER)"
-                        else:
-                            name = team + " (LOSER)"
-                        embed.add_field(
-                            name=name, value="------------------", inline=False
+    @post_match_details.before_loop
+    async def before_post_match_details(self):
+        # Channels can't be looked up until the cache is ready
+        await self.bot.wait_until_ready()
+
+    def upload_limit(self, channel_id):
+        """
+        Total attachment bytes a message to the channel may carry
+        """
+        channel = self.bot.get_channel(int(channel_id))
+        if channel is None or getattr(channel, "guild", None) is None:
+            return DEFAULT_UPLOAD_LIMIT_BYTES
+        return channel.guild.filesize_limit
+
+    async def send_matches(self, channel_id, batch, remaining):
+        """
+        Post (matchId, embed, imagePath, imageSize, renderedAt) entries to a channel
+        as a single message, marking matches posted once every channel
+        they belong in has them
+        """
+        channel = self.bot.get_channel(int(channel_id))
+        if not channel:
+            try:
+                channel = await self.bot.fetch_channel(int(channel_id))
+            except (discord.NotFound, discord.Forbidden):
+                # Deleted, or in a guild the bot left, stop posting there
+                logging.warn(f"Couldn't find channel {channel_id}, disabling it")
+                await disable_channel(channel_id)
+                return
+            except discord.HTTPException as e:
+                logging.warn(f"Error while looking up channel {channel_id}: {e}")
+                return
+        try:
+            message = await channel.send(
+                embeds=[embed for _, embed, _, _, _ in batch],
+                files=[
+                    discord.File(imagePath, filename=os.path.basename(imagePath))
+                    for _, _, imagePath, _, _ in batch
+                ],
+            )
+        except (discord.NotFound, discord.Forbidden) as e:
+            # Missing permissions or a deleted channel won't fix themselves
+            logging.warn(f"Can't post to channel {channel_id}, disabling it: {e}")
+            await disable_channel(channel_id)
+            return
+        except discord.HTTPException as e:
+            failures = self.channel_backoff.get(channel_id, (0, 0))[0] + 1
+            delay = min(
+                CHANNEL_BACKOFF_SECONDS * 2 ** (failures - 1),
+                CHANNEL_BACKOFF_CAP_SECONDS,
+            )
+            self.channel_backoff[channel_id] = (failures, time.monotonic() + delay)
+            logging.warn(
+                f"Error while posting to channel {channel_id}, retrying in {delay}s: {e}"
+            )
+            return
+        self.channel_backoff.pop(channel_id, None)
+
+        async with get_async_cursor() as c:
+            await c.execute(
+                """
+                INSERT INTO match_post (matchId, channel_id, discordMessageId)
+                SELECT unnest(%s::text[]), %s, %s
+                ON CONFLICT (matchId, channel_id) DO NOTHING
+                """,
+                (
+                    [matchId for matchId, _, _, _, _ in batch],
+                    channel_id,
+                    str(message.id),
+                ),
+            )
+        logging.debug(
+            f"Posted matches {', '.join(m for m, _, _, _, _ in batch)} to {channel_id}"
+        )
+
+        done = []
+        for matchId, _, _, _, renderedAt in batch:
+            remaining[matchId].discard(channel_id)
+            if not remaining[matchId]:
+                done.append((matchId, renderedAt))
+        await mark_matches_posted(done, message.id)
+
+
+async def disable_channel(channel_id):
+    """
+    Stop posting to a channel that can't be found anymore
+    """
+    async with get_async_cursor() as c:
+        await c.execute(
+            """
+            UPDATE guild_config
+            SET game_log_channel_id = NULL
+            WHERE game_log_channel_id = %s
+            """,
+            (str(channel_id),),
+        )
+
+
+async def retire_match(matchId):
+    """
+    Retire a match no channel wants, leaving its lifecycle timestamps unset
+    """
+    async with get_async_cursor() as c:
+        await c.execute(
+            """
+            UPDATE match_info SET posted = TRUE WHERE matchId = %s
+            """,
+            (matchId,),
+        )
+
+
+async def mark_matches_posted(matches, message_id):
+    """
+    Mark (matchId, renderedAt) pairs as posted to all of their channels
+    """
+    if not matches:
+        return
+    async with get_async_cursor() as c:
+        await c.execute(
+            """
+            UPDATE match_info mi
+            SET
+                posted = TRUE,
+                renderedAt = COALESCE(rendered.renderedAt, mi.renderedAt),
+                postedAt = now(),
+                discordMessageId = COALESCE(%s, mi.discordMessageId)
+            FROM unnest(%s::text[], %s::timestamp[]) AS rendered(matchId, renderedAt)
+            WHERE mi.matchId = rendered.matchId
+            """,
+            (
+                str(message_id) if message_id else None,
+                [matchId for matchId, _ in matches],
+                [renderedAt for _, renderedAt in matches],
+            ),
+        )
+
+
+async def stream_matches(pending):
+    """
+    Load the trimmed matchInfo of the pending matchIds POST_SCAN_BATCH_SIZE at a time.
+    Only the row count is bounded, the trimmed documents are all small.
+    Each match comes with the (guild_id, channel_id) pairs it still has to be posted to.
+    """
+    for start in range(0, len(pending), POST_SCAN_BATCH_SIZE):
+        chunk = pending[start : start + POST_SCAN_BATCH_SIZE]
+        async with get_async_cursor() as c:
+            await c.execute(
+                f"""
+                SELECT
+                    mi.matchId,
+                    {lol.CARD_MATCH_INFO_SQL},
+                    ARRAY(
+                        SELECT DISTINCT ARRAY[gc.guild_id, gc.game_log_channel_id]
+                        FROM guild_tracked_player gtp
+                        JOIN guild_config gc ON gc.guild_id = gtp.guild_id
+                        WHERE gtp.puuid IN (
+                            SELECT jsonb_array_elements_text(
+                                mi.matchInfo->'metadata'->'participants'
+                            )
                         )
+                            AND gc.game_log_channel_id IS NOT NULL
+                            AND NOT EXISTS (
+                                SELECT 1 FROM match_post mp
+                                WHERE mp.matchId = mi.matchId
+                                    AND mp.channel_id = gc.game_log_channel_id
+                            )
+                    )
+                FROM match_info mi
+                WHERE mi.matchId = ANY(%s)
+                ORDER BY mi.matchId asc
+                """,
+                (chunk,),
+            )
+            matches = await c.fetchall()
+        for match in matches:
+            yield match
+
+
+async def build_match_embed(matchInfo, guild_id, stored_ranks=False):
+    """
+    Embed listing the players of a match tracked by guild_id. With stored_ranks,
+    ranks come from the stored history as of the end of the game instead of the API.
+    """
+    start_time = lol.epoch_to_datetime(matchInfo["info"]["gameCreation"])
+    central_timezone = pytz.timezone("US/Central")
+    start_time = start_time.astimezone(central_timezone)
+    readable_start = start_time.strftime("%B %d, %Y at %I:%M:%S %p %Z")
+    gameDuration = timedelta(seconds=matchInfo["info"]["gameDuration"])
+    embed = discord.Embed(
+        title="MATCH UPDATE!",
+        description=f"Start: {readable_start}\nDuration: {gameDuration}",
+        color=0x00FF00,
+    )
+    gameMap = lol.find_queue_from_id(matchInfo["info"]["queueId"])["map"]
+    queueDescription = lol.find_queue_from_id(matchInfo["info"]["queueId"])[
+        "description"
+    ]
+    embed.add_field(
+        name=gameMap,
+        value=queueDescription,
+    )
 
-                    value = f"""{participant['summonerName']}{nameAddon} - {tier.title()} {roman_to_int(rank) or ''} 
-                    {participant['championName']} - {participant['kills']}/{participant['deaths']}/{participant['assists']}"""
-                    embed.add_field(name="", value=value, inline=False)
-                    prev_team = team
-            with lol.MatchImageCreator(matchInfo) as imagePath:
-                with open(imagePath, "rb") as f:
-                    file = discord.File(f)
-                    embed.set_image(url=f"attachment://{imagePath}")
-                    await channel.send(file=file, embed=embed)
-            async with get_async_cursor() as c:
-                await c.execute(
-                    """
-                    UPDATE match_info
-                    SET posted = TRUE
-                    WHERE matchId = %s
-                    """,
-                    (matchId,),
+    # Example of adding more fields
+    team = ""
+    prev_team = None
+    tracked = await asyncio.to_thread(
+        lol.find_guild_discord_ids,
+        guild_id,
+        [participant["puuid"] for participant in matchInfo["info"]["participants"]],
+    )
+    for participant in matchInfo["info"]["participants"]:
+        nameAddon = ""
+        if participant["puuid"] in tracked:
+            discord_id = tracked[participant["puuid"]]
+            if stored_ranks:
+                result = await asyncio.to_thread(
+                    lol.get_stored_summoner_rank,
+                    participant["summonerId"],
+                    lol.epoch_to_datetime(matchInfo["info"]["gameCreation"])
+                    + gameDuration,
                 )
-            logging.debug(
-                f"Posted match {matchId} from {datetime.fromtimestamp(matchInfo['info']['gameCreation']/1000)}"
-            )
+            else:
+                result = await asyncio.to_thread(
+                    lol.get_summoner_rank, participant["summonerId"]
+                )
+            try:
+                tier, rank = result
+            except TypeError:
+                tier, rank = "Unranked", None
+
+            if not participant["win"]:
+                # make the embed's color red
+                embed.color = 0xFF0000
+            if discord_id:
+                discord_user = await bot.fetch_user(discord_id)
+                nameAddon = f" ({discord_user.mention})"
+
+            if participant["teamId"] == 100:
+                team = "Blue"
+            elif participant["teamId"] == 200:
+                team = "Red"
+
+            if team != prev_team:
+                if participant["win"]:
+                    name = team + " (WINNER)"
+                else:
+                    name = team + " (LOSER)"
+                embed.add_field(name=name, value="------------------", inline=False)
+
+            value = f"""{participant['summonerName']}{nameAddon} - {tier.title()} {roman_to_int(rank) or ''} 
+            {participant['championName']} - {participant['kills']}/{participant['deaths']}/{participant['assists']}"""
+            embed.add_field(name="", value=value, inline=False)
+            prev_team = team
+    return embed
 
 
 bot.add_cog(LolCog(bot))
@@ -159,9 +424,8 @@ async def on_ready():
     logging.info(f"{bot.user.name} has connected to Discord!")
 
 
-@bot.command(
-    description="Register a summoner name to track", guildId=discord.Object(id=GUILD_ID)
-)
+@bot.command(description="Register a summoner name to track")
+@discord.guild_only()
 async def register(ctx, name: str, tag: str = "NA1", associated_user: str = None):
     associated_user = await get_user_from_mention(
         bot, associated_user if associated_user else ctx.author.mention
@@ -173,44 +437,228 @@ async def register(ctx, name: str, tag: str = "NA1", associated_user: str = None
     with get_cursor() as c:
         c.execute(
             """
-            INSERT INTO summoner_discord_association (puuid, discord_id)
-            VALUES (%s, %s)
-            ON CONFLICT (puuid) DO UPDATE SET discord_id = %s
+            INSERT INTO guild_tracked_player (guild_id, puuid, discord_id)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (guild_id, puuid) DO UPDATE SET
+                discord_id = excluded.discord_id
             """,
-            (puuid, associated_user.id, associated_user.id),
+            (str(ctx.guild.id), puuid, str(associated_user.id)),
         )
 
     await ctx.respond(f"Registering {name} for {associated_user.mention}")
 
 
-@bot.command(
-    description="Deregister a summoner name to track",
-    guildId=discord.Object(id=GUILD_ID),
-)
+@bot.command(description="Deregister a summoner name to track")
+@discord.guild_only()
 async def deregister(ctx, name: str, tag: str = "NA1"):
     account_info = lol.summoner_lookup(name, tag=tag, tracked=True)
     name = account_info["name"]
     puuid = account_info["puuid"]
-    with get_async_cursor() as c:
+    async with get_async_cursor() as c:
         await c.execute(
             """
-            DELETE FROM summoner_discord_association
-            WHERE puuid = %s
+            DELETE FROM guild_tracked_player
+            WHERE guild_id = %s AND puuid = %s
             """,
-            (puuid,),
+            (str(ctx.guild.id), puuid),
         )
+        # Other guilds may still be following this player
         await c.execute(
             """
-            UPDATE account_info
-            SET tracked = FALSE
-            WHERE puuid = %s
+            SELECT 1 FROM guild_tracked_player WHERE puuid = %s
             """,
             (puuid,),
         )
+        if c.rowcount == 0:
+            await c.execute(
+                """
+                UPDATE account_info
+                SET tracked = FALSE
+                WHERE puuid = %s
+                """,
+                (puuid,),
+            )
 
     await ctx.respond(f"Deregistered {name}")
 
 
+@bot.command(description="Post this server's match updates in this channel")
+@discord.default_permissions(manage_guild=True)
+@discord.guild_only()
+async def setchannel(ctx):
+    async with get_async_cursor() as c:
+        await c.execute(
+            """
+            INSERT INTO guild_config (guild_id, game_log_channel_id)
+            VALUES (%s, %s)
+            ON CONFLICT (guild_id) DO UPDATE SET
+                game_log_channel_id = excluded.game_log_channel_id
+            """,
+            (str(ctx.guild.id), str(ctx.channel.id)),
+        )
+
+    await ctx.respond(f"Posting match updates in {ctx.channel.mention}")
+
+
+@bot.command(description="Show a summoner's recent stats")
+async def stats(ctx, name: str = None, tag: str = "NA1", days: int = 30):
+    if name:
+        try:
+            puuid = await asyncio.to_thread(lol.find_puuid_from_name, name, tag)
+        except Exception as e:
+            logging.warn(f"Error while looking up {name}#{tag}: {e}")
+            await ctx.respond(f"Couldn't find {name}#{tag}")
+            return
+    else:
+        async with get_async_cursor() as c:
+            # Prefer who the author is registered as in this guild
+            await c.execute(
+                """
+                SELECT puuid FROM guild_tracked_player
+                WHERE discord_id = %s
+                ORDER BY guild_id = %s DESC
+                LIMIT 1
+                """,
+                (str(ctx.author.id), str(ctx.guild.id) if ctx.guild else None),
+            )
+            retval = await c.fetchone()
+        if not retval:
+            await ctx.respond("No summoner registered for you, pass a name")
+            return
+        puuid = retval[0]
+
+    name = await asyncio.to_thread(lol.get_name_from_puuid, puuid)
+    player_stats = await asyncio.to_thread(lol.get_player_stats, puuid, days)
+    if not player_stats:
+        await ctx.respond(f"No games found for {name} in the last {days} days")
+        return
+
+    embed = discord.Embed(
+        title=f"{name} - last {days} days",
+        description=(
+            f"Games: {player_stats['games']}\n"
+            f"Win rate: {player_stats['wins'] / player_stats['games']:.0%}\n"
+            f"KDA: {player_stats['kda']:.2f}\n"
+            f"Damage share: {player_stats['damageShare']:.0%}"
+        ),
+        color=0x00FF00,
+    )
+    for champion in player_stats["champions"]:
+        embed.add_field(
+            name=champion["championName"],
+            value=f"{champion['games']} games - {champion['wins'] / champion['games']:.0%} WR - {champion['kda']:.2f} KDA",
+            inline=False,
+        )
+    await ctx.respond(embed=embed)
+
+
+@bot.command(description="Show tracked players by solo queue rank")
+@discord.guild_only()
+async def leaderboard(ctx):
+    standings = await asyncio.to_thread(lol.get_leaderboard, str(ctx.guild.id))
+    if not standings:
+        await ctx.respond("No ranked players found")
+        return
+
+    lines = [
+        f"{i}. {name} - {tier.title()} {roman_to_int(rank) or ''} {leaguePoints} LP ({wins}W/{losses}L)"
+        for i, (name, tier, rank, leaguePoints, wins, losses) in enumerate(
+            standings, start=1
+        )
+    ]
+    embed = discord.Embed(
+        title="Solo Queue Leaderboard", description="\n".join(lines), color=0x00FF00
+    )
+    await ctx.respond(embed=embed)
+
+
+@bot.command(description="Show who climbed the most in solo queue")
+@discord.guild_only()
+async def climbers(ctx, days: int = 7):
+    standings = await asyncio.to_thread(lol.get_climbers, str(ctx.guild.id), days)
+    if not standings:
+        await ctx.respond("No ranked players found")
+        return
+
+    lines = [
+        f"{i}. {name} - {climbed or 0:+d} ({tier.title()} {roman_to_int(rank) or ''} {leaguePoints} LP)"
+        for i, (name, tier, rank, leaguePoints, climbed) in enumerate(
+            standings, start=1
+        )
+    ]
+    embed = discord.Embed(
+        title=f"Top Climbers - last {days} days",
+        description="\n".join(lines),
+        color=0x00FF00,
+    )
+    await ctx.respond(embed=embed)
+
+
+@bot.command(description="Show a match card by match ID or a summoner's latest match")
+async def match(ctx, match_or_name: str, tag: str = "NA1"):
+    await ctx.defer()
+    if re.fullmatch(r"[A-Z0-9]+_\d+", match_or_name):
+        matchId = match_or_name
+    else:
+        try:
+            puuid = await asyncio.to_thread(
+                lol.find_puuid_from_name, match_or_name, tag
+            )
+        except Exception as e:
+            logging.warn(f"Error while looking up {match_or_name}#{tag}: {e}")
+            await ctx.respond(f"Couldn't find {match_or_name}#{tag}")
+            return
+        matchId = await asyncio.to_thread(lol.find_latest_match_id, puuid)
+        if not matchId:
+            await ctx.respond(f"No matches found for {match_or_name}")
+            return
+
+    matchInfo = await asyncio.to_thread(lol.get_match_details, matchId)
+    if not matchInfo or "info" not in matchInfo:
+        await ctx.respond(f"Couldn't find match {matchId}")
+        return
+
+    embed = await build_match_embed(
+        matchInfo, str(ctx.guild.id) if ctx.guild else None, stored_ranks=True
+    )
+    imagePath = await asyncio.to_thread(lol.MatchImageCreator(matchInfo).get_path)
+    filename = os.path.basename(imagePath)
+    embed.set_image(url=f"attachment://{filename}")
+    await ctx.respond(file=discord.File(imagePath, filename=filename), embed=embed)
+
+
+@bot.command(
+    description="Show how long matches spend in each stage before being posted",
+)
+async def latency(ctx, days: int = 7):
+    count, stages = await asyncio.to_thread(lol.get_latency_report, days)
+    if not count:
+        await ctx.respond(f"No matches posted in the last {days} days")
+        return
+
+    embed = discord.Embed(
+        title=f"Match latency - last {days} days",
+        description=f"{count} matches posted",
+        color=0x00FF00,
+    )
+    for name, p50, p95 in stages:
+        embed.add_field(
+            name=name,
+            value=f"p50 {timedelta(seconds=round(p50 or 0))} - p95 {timedelta(seconds=round(p95 or 0))}",
+            inline=False,
+        )
+    await ctx.respond(embed=embed)
+
+
+@bot.command(description="Retry fetching matches that were given up on")
+@commands.is_owner()
+async def requeue(ctx, match_id: str = None):
+    requeued = await asyncio.to_thread(
+        lol.requeue_dead_letter_matches, [match_id] if match_id else None
+    )
+    await ctx.respond(f"Requeued {requeued} matches")
+
+
 async def get_user_from_mention(discord_client, mention):
     # Extract the user ID from the mention string
     user_id = mention[3:-1] if mention[2] == "!" else mention[2:-1]
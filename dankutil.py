@@ -1,6 +1,12 @@
 import functools
+import json
 import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 @functools.cache
 def roman_to_int(s):
@@ -20,3 +26,21 @@ def roman_to_int(s):
         prev_value = value
 
     return total
+
+
+def json_loads(data):
+    """
+    Decode JSON from str or bytes, with orjson when it's installed
+    """
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    """
+    Encode obj as a JSON str, with orjson when it's installed
+    """
+    if orjson:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
@@ -1,9 +1,27 @@
 from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
 import logging
 import os
+import time
 
 import aiopg
 import psycopg2
+from psycopg2.extras import (
+    execute_values,
+    register_default_json,
+    register_default_jsonb,
+)
+
+from dankutil import json_loads
+
+
+RANK_HISTORY_RETENTION_MONTHS = int(os.environ.get("RANK_HISTORY_RETENTION_MONTHS", 24))
+MIGRATION_BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", 5000))
+BULK_INSERT_PAGE_SIZE = 1000
+
+# Decode json/jsonb columns with the fast codec, aiopg shares these typecasters
+register_default_json(globally=True, loads=json_loads)
+register_default_jsonb(globally=True, loads=json_loads)
 
 
 class DatabaseConnection:
@@ -56,82 +74,718 @@ async def get_async_cursor():
         yield cursor
 
 
+def bulk_insert(
+    c, table, columns, rows, on_conflict="", page_size=BULK_INSERT_PAGE_SIZE
+):
+    """
+    Insert rows with multi-row VALUES statements, one round trip per page_size rows,
+    and log the throughput. Returns the number of rows actually written.
+    """
+    if not rows:
+        return 0
+
+    started = time.perf_counter()
+    written = 0
+    for i in range(0, len(rows), page_size):
+        execute_values(
+            c,
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s {on_conflict}",
+            rows[i : i + page_size],
+            page_size=page_size,
+        )
+        written += c.rowcount
+    elapsed = time.perf_counter() - started
+    logging.log(
+        logging.INFO if len(rows) >= page_size else logging.DEBUG,
+        f"Bulk inserted {written}/{len(rows)} rows into {table} in {elapsed:.3f}s "
+        f"({len(rows) / max(elapsed, 1e-6):.0f} rows/s)",
+    )
+    return written
+
+
+MIGRATIONS = []
+MIGRATION_LOCK_ID = 7_411_802
+
+
+def migration(version, transaction=True):
+    """
+    Register a schema migration, the docstring is recorded as its description.
+    Migrations without a transaction (CONCURRENTLY index builds, batched backfills)
+    must be safe to re-run if they are interrupted part way.
+    """
+
+    def register(fn):
+        MIGRATIONS.append((version, fn.__doc__.strip(), transaction, fn))
+        return fn
+
+    return register
+
+
 def bootstrap_database():
     """
-    Create a new SQLite database with connection handled by the context manager,
-    using the reusable connection function.
+    Bring the schema up to date by applying every migration
+    that isn't recorded in schema_version yet
     """
     with get_cursor() as c:
         c.execute(
             """
-            CREATE OR REPLACE FUNCTION round_timestamp()
-            RETURNS TRIGGER AS $$
-            BEGIN
-                -- Round NEW.timestamp to the nearest minute
-                NEW.timestamp = date_trunc('hour', NEW.timestamp) + 
-                                INTERVAL '1 min' * ROUND(date_part('minute', NEW.timestamp));
-                RETURN NEW;
-            END;
-            $$ LANGUAGE plpgsql;
-            """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description TEXT,
+            appliedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
         )
+        # Only one process migrates at a time, the others wait and then skip
+        c.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            c.execute("SELECT version FROM schema_version")
+            applied = {version for (version,) in c.fetchall()}
+            for version, description, transaction, fn in sorted(
+                MIGRATIONS, key=lambda m: m[0]
+            ):
+                if version in applied:
+                    continue
+                logging.info(f"Applying migration {version}: {description}")
+                if transaction:
+                    c.execute("BEGIN")
+                try:
+                    fn(c)
+                    c.execute(
+                        """
+                        INSERT INTO schema_version (version, description)
+                        VALUES (%s, %s)
+                        """,
+                        (version, description),
+                    )
+                except Exception:
+                    if transaction:
+                        c.execute("ROLLBACK")
+                    raise
+                if transaction:
+                    c.execute("COMMIT")
+        finally:
+            c.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        ensure_rank_partitions(c, datetime.now())
+        logging.info("Database bootstrapped successfully.")
+
+
+def create_index_concurrently(c, name, definition):
+    """
+    Build an index without blocking writes to the table,
+    dropping the invalid leftover of an interrupted earlier attempt first
+    """
+    c.execute(
+        """
+        SELECT pg_index.indisvalid
+        FROM pg_index
+        JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = %s
+        """,
+        (name,),
+    )
+    existing = c.fetchone()
+    if existing and existing[0]:
+        return
+    if existing:
+        c.execute(f"DROP INDEX CONCURRENTLY {name}")
+    c.execute(f"CREATE INDEX CONCURRENTLY {name} ON {definition}")
+
+
+def backfill_in_batches(c, query, key, batch_size=MIGRATION_BATCH_SIZE):
+    """
+    Repeat a data backfill that touches at most %(batch_size)s rows per run,
+    committing each batch on its own. The query picks rows in key order where
+    {after} holds and returns their key columns, so every row is visited once
+    even when the update leaves it matching the backfill's filter.
+    """
+    total, after = 0, None
+    while True:
+        bound = f"({', '.join(key)}) > %(after)s" if after else "TRUE"
         c.execute(
-            """
-        CREATE TABLE IF NOT EXISTS account_info (
-            accountId TEXT,
-            profileIconId BIGINT,
-            revisionDate TIMESTAMP,
-            name TEXT,
-            id TEXT,
-            puuid TEXT PRIMARY KEY,
-            summonerLevel BIGINT,
-            tracked BOOLEAN DEFAULT FALSE,
-            lastUpdated TIMESTAMP DEFAULT '1900-01-01'
+            query.replace("{after}", bound),
+            {"batch_size": batch_size, "after": after},
         )
+        rows = c.fetchall()
+        total += len(rows)
+        if len(rows) < batch_size:
+            break
+        after = max(rows)
+        logging.info(f"Backfilled {total} rows")
+    return total
+
+
+@migration(1)
+def baseline_schema(c):
+    """
+    Baseline schema
+    """
+    c.execute(
+        """
+        CREATE OR REPLACE FUNCTION round_timestamp()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            -- Round NEW.timestamp to the nearest minute
+            NEW.timestamp = date_trunc('hour', NEW.timestamp) + 
+                            INTERVAL '1 min' * ROUND(date_part('minute', NEW.timestamp));
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS account_info (
+        accountId TEXT,
+        profileIconId BIGINT,
+        revisionDate TIMESTAMP,
+        name TEXT,
+        id TEXT,
+        puuid TEXT PRIMARY KEY,
+        summonerLevel BIGINT,
+        tracked BOOLEAN DEFAULT FALSE,
+        lastUpdated TIMESTAMP DEFAULT '1900-01-01'
+    )
+    """
+    )
+    c.execute(
         """
+    CREATE TABLE IF NOT EXISTS player_ranked_status (
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        leagueId TEXT,
+        summonerId TEXT,
+        summonerName TEXT,
+        queueType TEXT,
+        tier TEXT,
+        rank TEXT,
+        leaguePoints INT,
+        wins INT,
+        losses INT,
+        hotStreak BOOLEAN,
+        veteran BOOLEAN,
+        freshBlood BOOLEAN,
+        inactive BOOLEAN,
+        miniSeries JSON,
+        PRIMARY KEY (timestamp, summonerId, queueType)
+    );
+    CREATE OR REPLACE TRIGGER round_timestamp_before_insert
+    BEFORE INSERT ON player_ranked_status
+    FOR EACH ROW EXECUTE FUNCTION round_timestamp();
+    """
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS match_info (
+        matchId TEXT PRIMARY KEY,
+        matchInfo JSONB,
+        gameStartTimestamp TIMESTAMP,
+        posted BOOLEAN DEFAULT FALSE
+    )
+    """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS summoner_discord_association (
+            puuid TEXT PRIMARY KEY,
+            discord_id TEXT,
+            FOREIGN KEY (puuid) REFERENCES account_info (puuid)
         )
+        """
+    )
+
+
+@migration(2)
+def partitioned_rank_history(c):
+    """
+    Change-only rank snapshots in a monthly partitioned player_ranked_status
+    """
+    c.execute(
+        """
+        CREATE OR REPLACE FUNCTION ladder_score(tier TEXT, rank TEXT, leaguePoints INT)
+        RETURNS INT AS $$
+            -- 400 points per tier and 100 per division so LP breaks ties,
+            -- apex tiers share one LP ladder on top of Diamond I
+            SELECT CASE
+                WHEN tier IN ('MASTER', 'GRANDMASTER', 'CHALLENGER')
+                    THEN 2800 + COALESCE(leaguePoints, 0)
+                ELSE array_position(
+                    ARRAY['IRON', 'BRONZE', 'SILVER', 'GOLD', 'PLATINUM', 'EMERALD', 'DIAMOND'],
+                    tier
+                ) * 400 - 400
+                + (4 - array_position(ARRAY['I', 'II', 'III', 'IV'], rank)) * 100
+                + COALESCE(leaguePoints, 0)
+            END
+        $$ LANGUAGE sql IMMUTABLE;
+        """
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS player_ranked_latest (
+        summonerId TEXT,
+        queueType TEXT,
+        summonerName TEXT,
+        tier TEXT,
+        rank TEXT,
+        leaguePoints INT,
+        wins INT,
+        losses INT,
+        changedAt TIMESTAMP,
+        checkedAt TIMESTAMP,
+        ladderScore INT,
+        PRIMARY KEY (summonerId, queueType)
+    );
+    ALTER TABLE player_ranked_latest ADD COLUMN IF NOT EXISTS ladderScore INT;
+    CREATE INDEX IF NOT EXISTS player_ranked_latest_ladder_idx
+    ON player_ranked_latest (queueType, ladderScore DESC NULLS LAST);
+    """
+    )
+    c.execute(
+        """
+        CREATE OR REPLACE FUNCTION record_rank_change()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            latest player_ranked_latest%ROWTYPE;
+        BEGIN
+            NEW.ladderScore = ladder_score(NEW.tier, NEW.rank, NEW.leaguePoints);
+
+            SELECT * INTO latest
+            FROM player_ranked_latest
+            WHERE summonerId = NEW.summonerId AND queueType = NEW.queueType
+            FOR UPDATE;
+
+            -- Only keep a snapshot when the standing actually changed,
+            -- otherwise just remember that it was checked
+            IF FOUND AND (latest.tier, latest.rank, latest.leaguePoints, latest.wins, latest.losses)
+                IS NOT DISTINCT FROM (NEW.tier, NEW.rank, NEW.leaguePoints, NEW.wins, NEW.losses) THEN
+                UPDATE player_ranked_latest
+                SET checkedAt = GREATEST(checkedAt, NEW.timestamp)
+                WHERE summonerId = NEW.summonerId AND queueType = NEW.queueType;
+                RETURN NULL;
+            END IF;
+
+            INSERT INTO player_ranked_latest (
+                summonerId, queueType, summonerName, tier, rank,
+                leaguePoints, wins, losses, changedAt, checkedAt, ladderScore
+            ) VALUES (
+                NEW.summonerId, NEW.queueType, NEW.summonerName, NEW.tier, NEW.rank,
+                NEW.leaguePoints, NEW.wins, NEW.losses, NEW.timestamp, NEW.timestamp,
+                NEW.ladderScore
+            )
+            ON CONFLICT (summonerId, queueType) DO UPDATE SET
+                summonerName = excluded.summonerName,
+                tier = excluded.tier,
+                rank = excluded.rank,
+                leaguePoints = excluded.leaguePoints,
+                wins = excluded.wins,
+                losses = excluded.losses,
+                changedAt = excluded.changedAt,
+                checkedAt = excluded.checkedAt,
+                ladderScore = excluded.ladderScore;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    c.execute(
+        """
+        SELECT relkind FROM pg_class
+        WHERE relname = 'player_ranked_status'
+            AND relnamespace = 'public'::regnamespace
+        """
+    )
+    relkind = c.fetchone()
+    if relkind and relkind[0] == "r":
+        # Snapshots used to be written on every poll into a plain table,
+        # move it aside so it can be copied into the partitioned layout
+        logging.info("Partitioning player_ranked_status")
         c.execute(
             """
-        CREATE TABLE IF NOT EXISTS player_ranked_status (
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            leagueId TEXT,
-            summonerId TEXT,
-            summonerName TEXT,
-            queueType TEXT,
-            tier TEXT,
-            rank TEXT,
-            leaguePoints INT,
-            wins INT,
-            losses INT,
-            hotStreak BOOLEAN,
-            veteran BOOLEAN,
-            freshBlood BOOLEAN,
-            inactive BOOLEAN,
-            miniSeries JSON,
-            PRIMARY KEY (timestamp, summonerId, queueType)
-        );
-        CREATE OR REPLACE TRIGGER round_timestamp_before_insert
-        BEFORE INSERT ON player_ranked_status
-        FOR EACH ROW EXECUTE FUNCTION round_timestamp();
+        ALTER TABLE player_ranked_status
+            RENAME TO player_ranked_status_unpartitioned;
+        ALTER TABLE player_ranked_status_unpartitioned
+            RENAME CONSTRAINT player_ranked_status_pkey
+            TO player_ranked_status_unpartitioned_pkey;
         """
         )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS player_ranked_status (
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        leagueId TEXT,
+        summonerId TEXT,
+        summonerName TEXT,
+        queueType TEXT,
+        tier TEXT,
+        rank TEXT,
+        leaguePoints INT,
+        wins INT,
+        losses INT,
+        hotStreak BOOLEAN,
+        veteran BOOLEAN,
+        freshBlood BOOLEAN,
+        inactive BOOLEAN,
+        miniSeries JSON,
+        ladderScore INT,
+        PRIMARY KEY (timestamp, summonerId, queueType)
+    ) PARTITION BY RANGE (timestamp);
+    ALTER TABLE player_ranked_status ADD COLUMN IF NOT EXISTS ladderScore INT;
+    CREATE INDEX IF NOT EXISTS player_ranked_status_summoner_idx
+    ON player_ranked_status (summonerId, queueType, timestamp DESC);
+    CREATE OR REPLACE TRIGGER round_timestamp_before_insert
+    BEFORE INSERT ON player_ranked_status
+    FOR EACH ROW EXECUTE FUNCTION round_timestamp();
+    CREATE OR REPLACE TRIGGER rank_change_before_insert
+    BEFORE INSERT ON player_ranked_status
+    FOR EACH ROW EXECUTE FUNCTION record_rank_change();
+    """
+    )
+    ensure_rank_partitions(c, datetime.now())
+    if relkind and relkind[0] == "r":
+        c.execute("SELECT min(timestamp) FROM player_ranked_status_unpartitioned")
+        ensure_rank_partitions(c, c.fetchone()[0] or datetime.now())
+        # Replaying in order lets the trigger drop the duplicate snapshots
         c.execute(
             """
-        CREATE TABLE IF NOT EXISTS match_info (
-            matchId TEXT PRIMARY KEY,
-            matchInfo JSONB,
-            gameStartTimestamp TIMESTAMP,
-            posted BOOLEAN DEFAULT FALSE
+        INSERT INTO player_ranked_status (
+            timestamp, leagueId, summonerId, summonerName, queueType, tier,
+            rank, leaguePoints, wins, losses, hotStreak, veteran, freshBlood,
+            inactive, miniSeries
         )
+        SELECT
+            timestamp, leagueId, summonerId, summonerName, queueType, tier,
+            rank, leaguePoints, wins, losses, hotStreak, veteran, freshBlood,
+            inactive, miniSeries
+        FROM player_ranked_status_unpartitioned
+        ORDER BY timestamp ASC;
+        DROP TABLE player_ranked_status_unpartitioned;
         """
         )
+
+
+@migration(3)
+def player_champion_stats(c):
+    """
+    Per-(puuid, day, champion, queue) match aggregates
+    """
+    c.execute(
+        """
+    ALTER TABLE match_info
+    ADD COLUMN IF NOT EXISTS statsAggregated BOOLEAN DEFAULT FALSE;
+    CREATE TABLE IF NOT EXISTS player_champion_stats (
+        puuid TEXT,
+        day DATE,
+        championId INT,
+        queueId INT,
+        championName TEXT,
+        games INT,
+        wins INT,
+        kills INT,
+        deaths INT,
+        assists INT,
+        damage BIGINT,
+        teamDamage BIGINT,
+        PRIMARY KEY (puuid, day, championId, queueId)
+    )
+    """
+    )
+
+
+@migration(4, transaction=False)
+def match_info_stats_pending_index(c):
+    """
+    Index matches whose stats haven't been aggregated yet
+    """
+    create_index_concurrently(
+        c,
+        "match_info_stats_pending_idx",
+        "match_info (matchId) WHERE statsAggregated = FALSE AND matchInfo IS NOT NULL",
+    )
+
+
+@migration(5, transaction=False)
+def backfill_ladder_scores(c):
+    """
+    Backfill ladder scores on rank rows written before they were computed
+    """
+    c.execute(
+        """
+        UPDATE player_ranked_latest
+        SET ladderScore = ladder_score(tier, rank, leaguePoints)
+        WHERE ladderScore IS NULL
+        """
+    )
+    backfill_in_batches(
+        c,
+        """
+        UPDATE player_ranked_status
+        SET ladderScore = ladder_score(tier, rank, leaguePoints)
+        WHERE (timestamp, summonerId, queueType) IN (
+            SELECT timestamp, summonerId, queueType
+            FROM player_ranked_status
+            WHERE ladderScore IS NULL
+                AND ladder_score(tier, rank, leaguePoints) IS NOT NULL
+                AND {after}
+            ORDER BY timestamp, summonerId, queueType
+            LIMIT %(batch_size)s
+        )
+        RETURNING timestamp, summonerId, queueType
+        """,
+        ["timestamp", "summonerId", "queueType"],
+    )
+
+
+@migration(6)
+def match_fetch_retry_queue(c):
+    """
+    Per-match fetch attempts, backoff schedule and dead letter state
+    """
+    c.execute(
+        """
+    ALTER TABLE match_info
+    ADD COLUMN IF NOT EXISTS fetchAttempts INT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS nextFetchAt TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS lastFetchError TEXT,
+    ADD COLUMN IF NOT EXISTS fetchDeadLetter BOOLEAN NOT NULL DEFAULT FALSE
+    """
+    )
+
+
+@migration(7, transaction=False)
+def match_info_fetch_pending_index(c):
+    """
+    Index matches still waiting to be fetched
+    """
+    create_index_concurrently(
+        c,
+        "match_info_fetch_pending_idx",
+        "match_info (matchId DESC) WHERE matchInfo IS NULL AND fetchDeadLetter = FALSE",
+    )
+
+
+@migration(8, transaction=False)
+def requeue_failed_match_fetches(c):
+    """
+    Requeue matches that were marked as errors after a single failed fetch
+    """
+    backfill_in_batches(
+        c,
+        """
+        UPDATE match_info
+        SET matchInfo = NULL, posted = FALSE, lastFetchError = 'requeued'
+        WHERE matchId IN (
+            SELECT matchId FROM match_info
+            WHERE matchInfo = '{"error": "error"}' AND {after}
+            ORDER BY matchId
+            LIMIT %(batch_size)s
+        )
+        RETURNING matchId
+        """,
+        ["matchId"],
+    )
+
+
+@migration(9, transaction=False)
+def match_info_participants_index(c):
+    """
+    Index match participants for per-player match lookups
+    """
+    create_index_concurrently(
+        c,
+        "match_info_participants_idx",
+        "match_info USING gin ((matchInfo->'metadata'->'participants'))",
+    )
+
+
+@migration(10)
+def match_lifecycle_timestamps(c):
+    """
+    Per-match discovery, fetch, render and post timestamps
+    """
+    # The default is set separately so rows from before now stay NULL
+    # instead of all claiming to be discovered during the migration
+    c.execute(
+        """
+    ALTER TABLE match_info
+    ADD COLUMN IF NOT EXISTS discoveredAt TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS fetchedAt TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS renderedAt TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS postedAt TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS discordMessageId TEXT;
+    ALTER TABLE match_info ALTER COLUMN discoveredAt SET DEFAULT now();
+    """
+    )
+
+
+@migration(11, transaction=False)
+def match_info_posted_at_index(c):
+    """
+    Index posted matches by post time for latency reports
+    """
+    create_index_concurrently(
+        c,
+        "match_info_posted_at_idx",
+        "match_info (postedAt) WHERE postedAt IS NOT NULL",
+    )
+
+
+@migration(12)
+def guild_fan_out(c):
+    """
+    Per-guild channels, guild to tracked player mapping and per-channel post state
+    """
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS guild_config (
+        guild_id TEXT PRIMARY KEY,
+        game_log_channel_id TEXT
+    );
+    CREATE TABLE IF NOT EXISTS guild_tracked_player (
+        guild_id TEXT,
+        puuid TEXT,
+        PRIMARY KEY (guild_id, puuid),
+        FOREIGN KEY (puuid) REFERENCES account_info (puuid)
+    );
+    CREATE INDEX IF NOT EXISTS guild_tracked_player_puuid_idx
+    ON guild_tracked_player (puuid);
+    CREATE TABLE IF NOT EXISTS match_post (
+        matchId TEXT,
+        channel_id TEXT,
+        discordMessageId TEXT,
+        postedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (matchId, channel_id)
+    );
+    """
+    )
+    # Carry over the single guild the bot used to be configured for
+    guild_id = os.environ.get("GUILD_ID")
+    channel_id = os.environ.get("GAME_LOG_CHANNEL_ID")
+    if guild_id and channel_id:
         c.execute(
             """
-            CREATE TABLE IF NOT EXISTS summoner_discord_association (
-                puuid TEXT PRIMARY KEY,
-                discord_id TEXT,
-                FOREIGN KEY (puuid) REFERENCES account_info (puuid)
-            )
+            INSERT INTO guild_config (guild_id, game_log_channel_id)
+            VALUES (%s, %s)
+            ON CONFLICT (guild_id) DO NOTHING
+            """,
+            (guild_id, channel_id),
+        )
+        c.execute(
             """
+            INSERT INTO guild_tracked_player (guild_id, puuid)
+            SELECT %s, puuid FROM account_info WHERE tracked = TRUE
+            ON CONFLICT (guild_id, puuid) DO NOTHING
+            """,
+            (guild_id,),
         )
-        logging.info("Database bootstrapped successfully.")
+
+
+@migration(13)
+def live_game_tracking(c):
+    """
+    Live games seen through spectator-v5 for tracked players
+    """
+    c.execute(
+        """
+    ALTER TABLE account_info
+    ADD COLUMN IF NOT EXISTS lastSpectated TIMESTAMP DEFAULT '1900-01-01';
+    CREATE TABLE IF NOT EXISTS live_game (
+        puuid TEXT PRIMARY KEY,
+        gameId BIGINT,
+        platformId TEXT,
+        seenAt TIMESTAMP,
+        FOREIGN KEY (puuid) REFERENCES account_info (puuid)
+    );
+    """
+    )
+
+
+@migration(14)
+def guild_discord_association(c):
+    """
+    Key the Discord user a player is registered for by guild
+    """
+    c.execute(
+        """
+    ALTER TABLE guild_tracked_player ADD COLUMN IF NOT EXISTS discord_id TEXT;
+    UPDATE guild_tracked_player gtp
+    SET discord_id = sda.discord_id
+    FROM summoner_discord_association sda
+    WHERE sda.puuid = gtp.puuid AND gtp.discord_id IS NULL;
+    DROP TABLE summoner_discord_association;
+    """
+    )
+
+
+@migration(15)
+def ladder_index_nulls_last(c):
+    """
+    Sort unmapped ranks after everyone else in the ladder index
+    """
+    c.execute(
+        """
+    DROP INDEX IF EXISTS player_ranked_latest_ladder_idx;
+    CREATE INDEX player_ranked_latest_ladder_idx
+    ON player_ranked_latest (queueType, ladderScore DESC NULLS LAST);
+    """
+    )
+
+
+def month_start(dt, offset=0):
+    """
+    Return the first day of the month containing dt, shifted by offset months
+    """
+    month = dt.year * 12 + dt.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def ensure_rank_partitions(c, start, months_ahead=2):
+    """
+    Create the monthly player_ranked_status partitions from start
+    through months_ahead months past the current one
+    """
+    month = month_start(start)
+    end = month_start(datetime.now(), months_ahead + 1)
+    while month < end:
+        next_month = month_start(month, 1)
+        c.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS player_ranked_status_{month:%Y%m}
+            PARTITION OF player_ranked_status
+            FOR VALUES FROM (%s) TO (%s)
+            """,
+            (month, next_month),
+        )
+        month = next_month
+
+
+def drop_expired_rank_partitions(c):
+    """
+    Drop player_ranked_status partitions that ended more than
+    RANK_HISTORY_RETENTION_MONTHS ago, 0 keeps history forever
+    """
+    if RANK_HISTORY_RETENTION_MONTHS <= 0:
+        return
+
+    cutoff = month_start(datetime.now(), -RANK_HISTORY_RETENTION_MONTHS)
+    c.execute(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+        JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        WHERE parent.relname = 'player_ranked_status'
+        """
+    )
+    for (partition,) in c.fetchall():
+        try:
+            month = datetime.strptime(partition.rsplit("_", 1)[-1], "%Y%m")
+        except ValueError:
+            continue
+        if month_start(month, 1) <= cutoff:
+            logging.info(f"Dropping expired rank partition {partition}")
+            c.execute(f"DROP TABLE {partition}")
+
+
+def maintain_rank_partitions():
+    with get_cursor() as c:
+        ensure_rank_partitions(c, datetime.now())
+        drop_expired_rank_partitions(c)
@@ -0,0 +1,245 @@
+"""
+Stream match and rank history out of the database into chunked, compressed files
+
+    python export.py match_info --out export --puuid <puuid> --since 2024-01-01
+    python export.py player_ranked_status --out export --format parquet
+
+Each chunk is read in its own short transaction through a server-side cursor,
+so memory stays flat and the live polling loops are never held up.
+Progress is checkpointed after every chunk and picked up again on the next run.
+"""
+
+import argparse
+from datetime import datetime
+import gzip
+import logging
+import os
+
+from dankutil import json_dumps, json_loads
+from db import get_cursor
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_CHUNK_ROWS = 50000
+EXPORT_ITERSIZE = 2000
+
+# Columns map to the Arrow type they are written as in Parquet
+EXPORTS = {
+    "match_info": {
+        "columns": {
+            "matchId": "string",
+            "gameStartTimestamp": "timestamp[us]",
+            "matchInfo": "string",
+        },
+        "key": ["matchId"],
+        "time": "gameStartTimestamp",
+        "puuid": "matchInfo->'metadata'->'participants' ? %(puuid)s",
+    },
+    "player_ranked_status": {
+        "columns": {
+            "timestamp": "timestamp[us]",
+            "summonerId": "string",
+            "queueType": "string",
+            "leagueId": "string",
+            "summonerName": "string",
+            "tier": "string",
+            "rank": "string",
+            "leaguePoints": "int32",
+            "wins": "int32",
+            "losses": "int32",
+            "hotStreak": "bool",
+            "veteran": "bool",
+            "freshBlood": "bool",
+            "inactive": "bool",
+            "miniSeries": "string",
+            "ladderScore": "int32",
+        },
+        "key": ["timestamp", "summonerId", "queueType"],
+        "time": "timestamp",
+        "puuid": "summonerId IN (SELECT id FROM account_info WHERE puuid = %(puuid)s)",
+    },
+}
+
+
+def build_query(table, filters, last_key, fmt):
+    """
+    Select the next chunk after last_key in key order. NDJSON rows are
+    serialized by Postgres so JSONB documents never get decoded here.
+    """
+    spec = EXPORTS[table]
+    where = ["TRUE"]
+    params = {"limit": EXPORT_CHUNK_ROWS}
+    if filters["puuid"]:
+        where.append(spec["puuid"])
+        params["puuid"] = filters["puuid"]
+    if filters["since"]:
+        where.append(f"{spec['time']} >= %(since)s")
+        params["since"] = filters["since"]
+    if filters["until"]:
+        where.append(f"{spec['time']} < %(until)s")
+        params["until"] = filters["until"]
+    if last_key:
+        where.append(
+            f"({', '.join(spec['key'])}) > "
+            f"({', '.join(f'%(key{i})s' for i in range(len(last_key)))})"
+        )
+        params.update({f"key{i}": value for i, value in enumerate(last_key)})
+
+    columns = ", ".join(
+        (
+            f'{column}::text AS "{column}"'
+            if fmt == "parquet" and column in ("matchInfo", "miniSeries")
+            else f'{column} AS "{column}"'
+        )
+        for column in spec["columns"]
+    )
+    rows = f"""
+        SELECT {columns}
+        FROM {table}
+        WHERE {" AND ".join(where)}
+        ORDER BY {", ".join(spec["key"])}
+        LIMIT %(limit)s
+    """
+    keys = ", ".join(f't."{column}"' for column in spec["key"])
+    if fmt == "ndjson":
+        select = f"SELECT {keys}, to_jsonb(t)::text"
+    else:
+        select = f"SELECT {keys}, t.*"
+    return f"{select} FROM ({rows}) t ORDER BY {keys}", params
+
+
+def write_chunk(rows, path, fmt, key_length, columns):
+    """
+    Write the rows of one chunk to path, returning the row count and the last key.
+    Parquet rows are flushed a record batch at a time so a chunk is never held whole.
+    """
+    count, last_key = 0, None
+    tmp_path = f"{path}.tmp"
+    if fmt == "ndjson":
+        with gzip.open(tmp_path, "wt", compresslevel=6) as f:
+            for row in rows:
+                f.write(row[key_length] + "\n")
+                count, last_key = count + 1, row[:key_length]
+    else:
+        names = list(columns)
+        schema = pyarrow.schema(
+            [(name, pyarrow.type_for_alias(alias)) for name, alias in columns.items()]
+        )
+        with pyarrow.parquet.ParquetWriter(
+            tmp_path, schema, compression="zstd"
+        ) as writer:
+            records = []
+            for row in rows:
+                records.append(dict(zip(names, row[key_length:])))
+                count, last_key = count + 1, row[:key_length]
+                if len(records) >= EXPORT_ITERSIZE:
+                    writer.write_batch(
+                        pyarrow.RecordBatch.from_pylist(records, schema=schema)
+                    )
+                    records = []
+            if records:
+                writer.write_batch(
+                    pyarrow.RecordBatch.from_pylist(records, schema=schema)
+                )
+
+    if count:
+        os.replace(tmp_path, path)
+    elif os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return count, last_key
+
+
+def export_table(table, out, fmt="ndjson", puuid=None, since=None, until=None):
+    """
+    Export table into numbered chunk files under out,
+    resuming after the last chunk recorded in the checkpoint
+    """
+    filters = {"puuid": puuid, "since": since, "until": until}
+    os.makedirs(out, exist_ok=True)
+    checkpoint_path = os.path.join(out, f"{table}.checkpoint.json")
+    chunk, last_key, total = 0, None, 0
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "rb") as f:
+            checkpoint = json_loads(f.read())
+        if checkpoint["filters"] != filters or checkpoint["format"] != fmt:
+            raise Exception(
+                f"{checkpoint_path} was written with different options, "
+                "remove it or export to a new directory"
+            )
+        chunk, last_key, total = (
+            checkpoint["chunk"],
+            checkpoint["lastKey"],
+            checkpoint["rows"],
+        )
+        logging.info(f"Resuming {table} export after chunk {chunk} ({total} rows)")
+
+    extension = "ndjson.gz" if fmt == "ndjson" else "parquet"
+    key_length = len(EXPORTS[table]["key"])
+    columns = EXPORTS[table]["columns"]
+    with get_cursor() as c:
+        c.execute("SET statement_timeout = 0")
+        conn = c.connection
+        conn.autocommit = False
+        conn.set_session(readonly=True)
+        while True:
+            query, params = build_query(table, filters, last_key, fmt)
+            path = os.path.join(out, f"{table}-{chunk + 1:06d}.{extension}")
+            # One short transaction per chunk so no snapshot is held for the whole export
+            with conn.cursor(name=f"export_{table}") as rows:
+                rows.itersize = EXPORT_ITERSIZE
+                rows.execute(query, params)
+                count, key = write_chunk(rows, path, fmt, key_length, columns)
+            conn.commit()
+            if not count:
+                break
+
+            chunk, total = chunk + 1, total + count
+            last_key = [
+                value.isoformat() if isinstance(value, datetime) else value
+                for value in key
+            ]
+            with open(f"{checkpoint_path}.tmp", "w") as f:
+                f.write(
+                    json_dumps(
+                        {
+                            "filters": filters,
+                            "format": fmt,
+                            "chunk": chunk,
+                            "lastKey": last_key,
+                            "rows": total,
+                        }
+                    )
+                )
+            os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+            logging.info(f"Exported {total} rows of {table} into {chunk} chunks")
+
+    logging.info(f"Finished exporting {table}: {total} rows in {chunk} chunks")
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("table", choices=EXPORTS)
+    parser.add_argument("--out", default="export")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    parser.add_argument("--puuid")
+    parser.add_argument("--since", help="start date, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--until", help="end date, exclusive (YYYY-MM-DD)")
+    args = parser.parse_args()
+    if args.format == "parquet" and pyarrow is None:
+        parser.error("parquet export needs pyarrow installed")
+
+    export_table(
+        args.table,
+        args.out,
+        fmt=args.format,
+        puuid=args.puuid,
+        since=args.since,
+        until=args.until,
+    )
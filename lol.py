@@ -1,24 +1,57 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from functools import cache
 import hashlib
-import json
+import io
 import logging
-import random
-import string
+import mmap
+import threading
 import time
 import os
+import re
 
 from dotenv import load_dotenv
 from PIL import Image, ImageDraw, ImageFont
 import requests
 
-from db import get_cursor
+from dankutil import json_dumps, json_loads
+from db import bulk_insert, get_cursor
 
 load_dotenv()
 
 RIOT_API_KEY = os.environ.get("RIOT_API_KEY")
 RIOT_API_BASE_URL = "https://na1.api.riotgames.com"
 
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", "./render_cache")
+RENDER_CACHE_MAX_BYTES = int(
+    os.environ.get("RENDER_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+# Bump whenever the card layout changes so stale renders aren't served
+CARD_LAYOUT_VERSION = 3
+
+DDRAGON_BASE_URL = "https://ddragon.leagueoflegends.com"
+CHAMPION_ATLAS_DIR = os.environ.get("CHAMPION_ATLAS_DIR", "./assets")
+PORTRAIT_SIZE = 90
+# Card text is shrunk down to this size to fit next to the portrait
+MIN_CARD_FONT_SIZE = 16
+# RGBA bytes of cached text bitmaps, a 40 px champion name is around 40 KB
+TEXT_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+MATCH_FETCH_TIMEOUT = 10
+GAME_START_PATTERN = re.compile(rb'"gameStartTimestamp"\s*:\s*(\d+)')
+MATCH_FETCH_MAX_ATTEMPTS = int(os.environ.get("MATCH_FETCH_MAX_ATTEMPTS", 8))
+MATCH_FETCH_BACKOFF_SECONDS = 30
+MATCH_FETCH_BACKOFF_CAP_SECONDS = 6 * 60 * 60
+# An expired or revoked API key, every fetch fails until it is replaced
+MATCH_FETCH_AUTH_BACKOFF_SECONDS = 5 * 60
+
+LIVE_GAME_TRACKING = os.environ.get("LIVE_GAME_TRACKING", "").lower() in ("1", "true")
+# Point at a local stand-in (see spectator_stub.py) to test without Riot
+SPECTATOR_BASE_URL = os.environ.get("SPECTATOR_BASE_URL", RIOT_API_BASE_URL)
+LIVE_GAME_POLL_BATCH = int(os.environ.get("LIVE_GAME_POLL_BATCH", 20))
+# match-v5 usually has a game a little while after it leaves spectator
+LIVE_GAME_FETCH_DELAY_SECONDS = 20
+
 
 @cache
 def get_name_from_puuid(puuid: str, tracked: bool = False):
@@ -37,7 +70,7 @@ def get_name_from_puuid(puuid: str, tracked: bool = False):
     headers = {"X-Riot-Token": RIOT_API_KEY}
     response = requests.get(url, headers=headers)
     if response.status_code == 200:
-        account_info = response.json()
+        account_info = json_loads(response.content)
         with get_cursor() as conn:
             conn.execute(
                 """
@@ -73,21 +106,28 @@ def get_name_from_puuid(puuid: str, tracked: bool = False):
         return account_info["name"]
 
 
-def summoner_lookup(name: str, tag: str = "NA1", tracked: bool = False):
+def riot_id_lookup(name: str, tag: str = "NA1"):
+    """
+    Resolve a Riot ID to a puuid through account-v1 without storing anything
+    """
     url = f"https://americas.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{name.replace(' ', '%20')}/{tag}"
     headers = {"X-Riot-Token": RIOT_API_KEY}
     response = requests.get(url, headers=headers)
     if response.status_code == 200:
-        puuid = response.json()["puuid"]
-    else:
-        raise Exception(
-            f"Error while looking up summoner: {response.status_code} - {response.text}"
-        )
+        return json_loads(response.content)["puuid"]
+    raise Exception(
+        f"Error while looking up summoner: {response.status_code} - {response.text}"
+    )
+
+
+def summoner_lookup(name: str, tag: str = "NA1", tracked: bool = False):
+    puuid = riot_id_lookup(name, tag)
 
     url = f"{RIOT_API_BASE_URL}/lol/summoner/v4/summoners/by-puuid/{puuid}"
+    headers = {"X-Riot-Token": RIOT_API_KEY}
     response = requests.get(url, headers=headers)
     if response.status_code == 200:
-        account_info = response.json()
+        account_info = json_loads(response.content)
         logging.info(f"{account_info}")
         # Store the account information in the database
         account_id = account_info["accountId"]
@@ -190,7 +230,7 @@ def get_matches(
     response = requests.get(url, headers=headers, params=params)
 
     if response.status_code == 200:
-        return response.json()
+        return json_loads(response.content)
     else:
         logging.warn(
             f"Error while looking up summoner: {response.status_code} - {response.text}"
@@ -233,13 +273,12 @@ def backfill_matches(puuid=None):
         timestamp = datetime.fromtimestamp(timestamp / 1000)
 
     with get_cursor() as c:
-        c.executemany(
-            """
-            INSERT INTO match_info (matchId)
-            VALUES (%s)
-            ON CONFLICT (matchId) DO NOTHING
-            """,
+        bulk_insert(
+            c,
+            "match_info",
+            ["matchId"],
             [(matchId,) for matchId in matches],
+            "ON CONFLICT (matchId) DO NOTHING",
         )
         c.execute(
             """
@@ -293,30 +332,148 @@ def forwardfill_matches():
         matches += new_matches
 
     with get_cursor() as c:
-        c.executemany(
-            """
-            INSERT INTO match_info (matchId)
-            VALUES (%s)
-            ON CONFLICT (matchId) DO NOTHING
-            """,
+        bulk_insert(
+            c,
+            "match_info",
+            ["matchId"],
             [(matchId,) for matchId in matches],
+            "ON CONFLICT (matchId) DO NOTHING",
         )
         logging.info(f"Saved {len(matches)} new matches")
     if not matches:
         logging.info("No new matches found")
 
 
+def track_live_games(limit=LIVE_GAME_POLL_BATCH):
+    """
+    Check the tracked players for a live game through spectator-v5. Up to half of
+    the batch goes to players already in a game, the rest to whoever was checked
+    least recently. When a recorded game is gone, its match is queued for a fetch
+    right away instead of waiting for forwardfill to reach the player again.
+    """
+    logging.debug("Starting track_live_games")
+    with get_cursor() as c:
+        c.execute(
+            """
+            WITH in_game AS (
+                SELECT ai.puuid
+                FROM account_info ai
+                JOIN live_game lg ON lg.puuid = ai.puuid
+                WHERE ai.tracked = TRUE
+                ORDER BY ai.lastSpectated ASC
+                LIMIT %(in_game_limit)s
+            )
+            SELECT puuid FROM in_game
+            UNION ALL (
+                SELECT ai.puuid
+                FROM account_info ai
+                WHERE ai.tracked = TRUE
+                    AND ai.puuid NOT IN (SELECT puuid FROM in_game)
+                ORDER BY ai.lastSpectated ASC
+                LIMIT %(limit)s
+            )
+            """,
+            {"in_game_limit": limit // 2, "limit": limit},
+        )
+        puuids = [puuid for (puuid,) in c.fetchall()][:limit]
+
+    headers = {"X-Riot-Token": RIOT_API_KEY}
+    # Failed lookups are stamped too, so a player that keeps erroring
+    # doesn't stay at the front of the queue
+    checked = []
+    ended = []
+    for puuid in puuids:
+        url = f"{SPECTATOR_BASE_URL}/lol/spectator/v5/active-games/by-summoner/{puuid}"
+        try:
+            response = requests.get(url, headers=headers, timeout=MATCH_FETCH_TIMEOUT)
+        except requests.RequestException as e:
+            logging.warn(f"Error while looking up live game: {e}")
+            checked.append(puuid)
+            continue
+
+        if response.status_code == 200:
+            game = json_loads(response.content)
+            with get_cursor() as c:
+                c.execute(
+                    """
+                    INSERT INTO live_game (puuid, gameId, platformId, seenAt)
+                    VALUES (%s, %s, %s, now())
+                    ON CONFLICT (puuid) DO UPDATE SET
+                        gameId = excluded.gameId,
+                        platformId = excluded.platformId,
+                        seenAt = excluded.seenAt
+                    """,
+                    (puuid, game["gameId"], game["platformId"]),
+                )
+        elif response.status_code == 404:
+            with get_cursor() as c:
+                c.execute(
+                    """
+                    DELETE FROM live_game
+                    WHERE puuid = %s
+                    RETURNING platformId, gameId
+                    """,
+                    (puuid,),
+                )
+                retval = c.fetchone()
+            if retval:
+                ended.append(f"{retval[0]}_{retval[1]}")
+        elif response.status_code == 429:
+            logging.warn(
+                f"Rate limit exceeded while looking up live game: {response.status_code} - {response.text}"
+            )
+            break
+        else:
+            logging.warn(
+                f"Error while looking up live game: {response.status_code} - {response.text}"
+            )
+        checked.append(puuid)
+
+    with get_cursor() as c:
+        c.execute(
+            """
+            UPDATE account_info
+            SET lastSpectated = now()
+            WHERE puuid = ANY(%s)
+            """,
+            (checked,),
+        )
+        if ended:
+            nextFetchAt = datetime.now() + timedelta(
+                seconds=LIVE_GAME_FETCH_DELAY_SECONDS
+            )
+            bulk_insert(
+                c,
+                "match_info",
+                ["matchId", "nextFetchAt"],
+                [(matchId, nextFetchAt) for matchId in set(ended)],
+                "ON CONFLICT (matchId) DO NOTHING",
+            )
+            logging.info(f"Queued {len(set(ended))} just finished matches")
+
+
+match_fetch_paused_until = 0.0
+
+
 def get_match_details(matchId=None):
     """
     Retrieve match details from the database and update the database if necessary
     If no matchId is provided, get the most recent match and update the database
+    without decoding it
     """
+    global match_fetch_paused_until
+    requested = matchId is not None
     if matchId == None:
+        if time.monotonic() < match_fetch_paused_until:
+            logging.debug("Match fetches are paused")
+            return
         with get_cursor() as c:
             c.execute(
                 """
                 SELECT matchId FROM match_info
                 WHERE matchInfo is null
+                    AND fetchDeadLetter = FALSE
+                    AND (nextFetchAt IS NULL OR nextFetchAt <= now())
                 ORDER BY matchId DESC
                 LIMIT 1
                 """
@@ -342,58 +499,268 @@ def get_match_details(matchId=None):
     url = f"https://americas.api.riotgames.com/lol/match/v5/matches/{matchId}"
     logging.debug(f"Not found in database, pinging url: {url}")
     headers = {"X-Riot-Token": RIOT_API_KEY}
-    response = requests.get(url, headers=headers)
+    try:
+        response = requests.get(url, headers=headers, timeout=MATCH_FETCH_TIMEOUT)
+    except requests.RequestException as e:
+        record_match_fetch_failure(matchId, repr(e))
+        logging.warn(f"Error while looking up match {matchId}: {e}")
+        return
 
     if response.status_code == 200:
         logging.debug(f"Found match details for {matchId}")
-        match_info = response.json()
+        # The payload goes into the JSONB column as is,
+        # only the start timestamp is picked out of the raw bytes
         timestamp = datetime.fromtimestamp(
-            match_info["info"]["gameStartTimestamp"] / 1000
+            int(GAME_START_PATTERN.search(response.content).group(1)) / 1000
         )
-        # Store the account information in the database
         with get_cursor() as c:
             c.execute(
                 """
-                INSERT INTO match_info (matchId, matchInfo, gameStartTimestamp)
-                VALUES (%s, %s, %s)
+                INSERT INTO match_info (matchId, matchInfo, gameStartTimestamp, fetchedAt)
+                VALUES (%s, %s, %s, now())
                 ON CONFLICT (matchId) DO UPDATE SET
                     matchInfo = excluded.matchInfo,
-                    gameStartTimestamp = excluded.gameStartTimestamp
+                    gameStartTimestamp = excluded.gameStartTimestamp,
+                    fetchedAt = excluded.fetchedAt
             """,
                 (
                     matchId,
-                    json.dumps(match_info),
+                    response.content.decode(),
                     timestamp,
                 ),
             )
         logging.info(
             f"Saved match details of {matchId} on {timestamp.strftime('%B %d, %Y, %I:%M:%S %p')}"
         )
-        return match_info
-    elif response.status_code == 429:
+        aggregate_match_stats(matchId)
+        if requested:
+            return json_loads(response.content)
+    elif response.status_code in (401, 403, 429):
+        # Being throttled or a bad key isn't the match's fault,
+        # pause all fetches and wait it out without using up an attempt
+        if response.status_code == 429:
+            retry_after = int(response.headers.get("Retry-After", 10))
+        else:
+            retry_after = MATCH_FETCH_AUTH_BACKOFF_SECONDS
+        match_fetch_paused_until = time.monotonic() + retry_after
+        record_match_fetch_failure(
+            matchId,
+            f"{response.status_code} - {response.text}",
+            retry_after=retry_after,
+        )
         logging.warn(
-            f"Rate limit exceeded while looking up match: {response.status_code} - {response.text}"
+            f"Pausing match fetches for {retry_after}s: {response.status_code} - {response.text}"
         )
     else:
-        with get_cursor() as c:
-            c.execute(
-                """
-                UPDATE match_info
-                SET matchInfo = '{"error": "error"}', posted = TRUE
-                WHERE matchId = %s
-                """,
-                (matchId,),
-            )
+        record_match_fetch_failure(matchId, f"{response.status_code} - {response.text}")
         logging.warn(
             f"Error while looking up match: {response.status_code} - {response.text}"
         )
 
 
-def find_discord_id_from_puuid(puuid):
+def record_match_fetch_failure(matchId, error, retry_after=None):
+    """
+    Schedule the next fetch of a match with exponential backoff and jitter,
+    moving it to the dead letter state after MATCH_FETCH_MAX_ATTEMPTS failures.
+    A retry_after in seconds overrides the backoff and doesn't count as an attempt.
+    """
+    with get_cursor() as c:
+        c.execute(
+            """
+            UPDATE match_info SET
+                fetchAttempts = fetchAttempts + %(counted)s,
+                fetchDeadLetter = fetchAttempts + %(counted)s >= %(max_attempts)s,
+                lastFetchError = %(error)s,
+                nextFetchAt = now() + make_interval(secs => COALESCE(
+                    %(retry_after)s,
+                    LEAST(%(base)s * 2 ^ fetchAttempts, %(cap)s) * (0.75 + random() / 2)
+                ))
+            WHERE matchId = %(matchId)s
+            RETURNING fetchAttempts, fetchDeadLetter
+            """,
+            {
+                "matchId": matchId,
+                "error": error[:1000],
+                "counted": 0 if retry_after is not None else 1,
+                "retry_after": retry_after,
+                "max_attempts": MATCH_FETCH_MAX_ATTEMPTS,
+                "base": MATCH_FETCH_BACKOFF_SECONDS,
+                "cap": MATCH_FETCH_BACKOFF_CAP_SECONDS,
+            },
+        )
+        retval = c.fetchone()
+    if retval and retval[1]:
+        logging.warn(f"Giving up on match {matchId} after {retval[0]} attempts")
+
+
+def requeue_dead_letter_matches(matchIds=None):
+    """
+    Give dead lettered matches a fresh set of fetch attempts,
+    all of them or only those in matchIds. Returns the number requeued.
+    """
+    with get_cursor() as c:
+        c.execute(
+            """
+            UPDATE match_info SET
+                fetchAttempts = 0,
+                fetchDeadLetter = FALSE,
+                nextFetchAt = NULL
+            WHERE fetchDeadLetter = TRUE
+                AND (%(matchIds)s::text[] IS NULL OR matchId = ANY(%(matchIds)s))
+            """,
+            {"matchIds": matchIds},
+        )
+        requeued = c.rowcount
+    logging.info(f"Requeued {requeued} dead lettered matches")
+    return requeued
+
+
+def aggregate_match_stats(matchId=None, limit=500):
+    """
+    Fold saved matches into the per-(puuid, day, champion, queue) totals
+    in player_champion_stats. Each match is only ever counted once.
+    Without a matchId, up to limit matches that haven't been counted yet are folded in.
+    Returns the number of matches aggregated.
+    """
+    with get_cursor() as c:
+        c.execute(
+            """
+            WITH claimed AS (
+                UPDATE match_info
+                SET statsAggregated = TRUE
+                WHERE matchId IN (
+                    SELECT matchId FROM match_info
+                    WHERE statsAggregated = FALSE
+                        AND matchInfo IS NOT NULL
+                        AND matchInfo ? 'info'
+                        AND (%(matchId)s::text IS NULL OR matchId = %(matchId)s)
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING matchId, matchInfo, gameStartTimestamp
+            ), participants AS (
+                SELECT
+                    p->>'puuid' AS puuid,
+                    cl.gameStartTimestamp::date AS day,
+                    (p->>'championId')::int AS championId,
+                    (cl.matchInfo->'info'->>'queueId')::int AS queueId,
+                    p->>'championName' AS championName,
+                    (p->>'win')::boolean AS win,
+                    (p->>'kills')::int AS kills,
+                    (p->>'deaths')::int AS deaths,
+                    (p->>'assists')::int AS assists,
+                    (p->>'totalDamageDealtToChampions')::bigint AS damage,
+                    sum((p->>'totalDamageDealtToChampions')::bigint) OVER (
+                        PARTITION BY cl.matchId, p->>'teamId'
+                    ) AS teamDamage
+                FROM claimed cl, jsonb_array_elements(cl.matchInfo->'info'->'participants') AS p
+            ), stats AS (
+                INSERT INTO player_champion_stats (
+                    puuid, day, championId, queueId, championName, games, wins,
+                    kills, deaths, assists, damage, teamDamage
+                )
+                SELECT
+                    puuid, day, championId, queueId, max(championName), count(*),
+                    count(*) FILTER (WHERE win), sum(kills), sum(deaths), sum(assists),
+                    sum(damage), sum(teamDamage)
+                FROM participants
+                GROUP BY puuid, day, championId, queueId
+                ON CONFLICT (puuid, day, championId, queueId) DO UPDATE SET
+                    championName = excluded.championName,
+                    games = player_champion_stats.games + excluded.games,
+                    wins = player_champion_stats.wins + excluded.wins,
+                    kills = player_champion_stats.kills + excluded.kills,
+                    deaths = player_champion_stats.deaths + excluded.deaths,
+                    assists = player_champion_stats.assists + excluded.assists,
+                    damage = player_champion_stats.damage + excluded.damage,
+                    teamDamage = player_champion_stats.teamDamage + excluded.teamDamage
+            )
+            SELECT count(*) FROM claimed
+            """,
+            {"matchId": matchId, "limit": limit},
+        )
+        aggregated = c.fetchone()[0]
+    if aggregated and matchId is None:
+        logging.info(f"Aggregated stats for {aggregated} matches")
+    return aggregated
+
+
+def get_player_stats(puuid, days=30, top_champions=5):
+    """
+    Summarize a player's games over the last days from player_champion_stats
+    Returns None when no games were found
+    """
+    since = datetime.now().date() - timedelta(days=days)
     with get_cursor() as c:
         c.execute(
             """
-            SELECT discord_id FROM summoner_discord_association WHERE puuid = %s
+            SELECT
+                sum(games), sum(wins), sum(kills), sum(deaths), sum(assists),
+                sum(damage), sum(teamDamage)
+            FROM player_champion_stats
+            WHERE puuid = %s AND day >= %s
+            """,
+            (puuid, since),
+        )
+        games, wins, kills, deaths, assists, damage, teamDamage = c.fetchone()
+        if not games:
+            return
+        c.execute(
+            """
+            SELECT
+                max(championName), sum(games), sum(wins),
+                sum(kills), sum(deaths), sum(assists)
+            FROM player_champion_stats
+            WHERE puuid = %s AND day >= %s
+            GROUP BY championId
+            ORDER BY sum(games) DESC, sum(wins) DESC
+            LIMIT %s
+            """,
+            (puuid, since, top_champions),
+        )
+        champions = c.fetchall()
+
+    return {
+        "games": games,
+        "wins": wins,
+        "kda": (kills + assists) / max(deaths, 1),
+        "damageShare": damage / max(teamDamage, 1),
+        "champions": [
+            {
+                "championName": championName,
+                "games": champGames,
+                "wins": champWins,
+                "kda": (champKills + champAssists) / max(champDeaths, 1),
+            }
+            for championName, champGames, champWins, champKills, champDeaths, champAssists in champions
+        ],
+    }
+
+
+def find_puuid_from_name(name: str, tag: str = "NA1"):
+    with get_cursor() as c:
+        c.execute(
+            """
+            SELECT puuid FROM account_info WHERE lower(name) = lower(%s)
+            """,
+            (name,),
+        )
+        retval = c.fetchone()
+    if retval:
+        return retval[0]
+    # Read only, summoner_lookup would overwrite the tracked flag
+    return riot_id_lookup(name, tag)
+
+
+def find_latest_match_id(puuid):
+    with get_cursor() as c:
+        c.execute(
+            """
+            SELECT matchId FROM match_info
+            WHERE matchInfo->'metadata'->'participants' ? %s
+                AND matchInfo ? 'info'
+            ORDER BY gameStartTimestamp DESC
+            LIMIT 1
             """,
             (puuid,),
         )
@@ -402,6 +769,33 @@ def find_discord_id_from_puuid(puuid):
         return retval[0]
 
 
+def find_tracked_puuids(puuids):
+    with get_cursor() as c:
+        c.execute(
+            """
+            SELECT puuid FROM account_info
+            WHERE tracked = TRUE AND puuid = ANY(%s)
+            """,
+            (puuids,),
+        )
+        return {puuid for (puuid,) in c.fetchall()}
+
+
+def find_guild_discord_ids(guild_id, puuids):
+    """
+    Map the puuids guild_id tracks to the Discord user registered for them there
+    """
+    with get_cursor() as c:
+        c.execute(
+            """
+            SELECT puuid, discord_id FROM guild_tracked_player
+            WHERE guild_id = %s AND puuid = ANY(%s)
+            """,
+            (guild_id, puuids),
+        )
+        return dict(c.fetchall())
+
+
 @cache
 def find_queue_from_id(queueId):
     logging.info("Downloading queue info")
@@ -409,7 +803,7 @@ def find_queue_from_id(queueId):
     # download the json file from the url above
     r = requests.get(url)
     if r.status_code == 200:
-        queues = r.json()
+        queues = json_loads(r.content)
         for queue in queues:
             if queue["queueId"] == queueId:
                 return queue
@@ -417,24 +811,23 @@ def find_queue_from_id(queueId):
 
 def get_summoner_rank(summonerId, queue="RANKED_SOLO_5x5"):
     """
-    Check to see if the most recently stored rank was in the last minute
+    Check to see if the rank was last checked in the last minute
     and if so, return that rank. Otherwise, ping the API and store the new rank.
+    A history snapshot is only written when the rank actually changed.
     """
     logging.debug(f"Getting rank for {summonerId}")
     with get_cursor() as c:
         c.execute(
             """
-            SELECT timestamp, tier, rank
-            FROM player_ranked_status
+            SELECT checkedAt, tier, rank
+            FROM player_ranked_latest
             WHERE summonerId = %s AND queueType = %s
-            ORDER BY timestamp DESC
-            LIMIT 1
             """,
             (summonerId, queue),
         )
         if c.rowcount > 0:
-            timestamp, tier, rank = c.fetchone()
-            if timestamp > datetime.now() - timedelta(minutes=1):
+            checkedAt, tier, rank = c.fetchone()
+            if checkedAt > datetime.now() - timedelta(minutes=1):
                 logging.debug(f"Found rank for {summonerId} in the database")
                 return tier, rank
 
@@ -442,18 +835,28 @@ def get_summoner_rank(summonerId, queue="RANKED_SOLO_5x5"):
     headers = {"X-Riot-Token": RIOT_API_KEY}
     response = requests.get(url, headers=headers)
     if response.status_code == 200:
-        league_entries = response.json()
+        league_entries = json_loads(response.content)
         logging.debug(f"Found {league_entries} league entries for {summonerId}")
         with get_cursor() as c:
-            c.executemany(
-                """
-                INSERT INTO player_ranked_status (
-                    leagueId, summonerId, summonerName, queueType, tier, rank,
-                    leaguePoints, wins, losses, hotStreak, veteran, freshBlood,
-                    inactive, miniSeries
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (timestamp, summonerId, queueType) DO NOTHING
-                """,
+            bulk_insert(
+                c,
+                "player_ranked_status",
+                [
+                    "leagueId",
+                    "summonerId",
+                    "summonerName",
+                    "queueType",
+                    "tier",
+                    "rank",
+                    "leaguePoints",
+                    "wins",
+                    "losses",
+                    "hotStreak",
+                    "veteran",
+                    "freshBlood",
+                    "inactive",
+                    "miniSeries",
+                ],
                 [
                     (
                         league_entry["leagueId"],
@@ -469,10 +872,11 @@ def get_summoner_rank(summonerId, queue="RANKED_SOLO_5x5"):
                         league_entry["veteran"],
                         league_entry["freshBlood"],
                         league_entry["inactive"],
-                        json.dumps(league_entry.get("miniSeries")),
+                        json_dumps(league_entry.get("miniSeries")),
                     )
                     for league_entry in league_entries
                 ],
+                "ON CONFLICT (timestamp, summonerId, queueType) DO NOTHING",
             )
         for league_entry in league_entries:
             if league_entry["queueType"] == queue:
@@ -481,17 +885,463 @@ def get_summoner_rank(summonerId, queue="RANKED_SOLO_5x5"):
         logging.debug(f"No rank found for {summonerId}")
 
 
-class MatchImageCreator:
-    def __init__(self, matchInfo, directory="./"):
-        self.matchInfo = matchInfo
+def get_stored_summoner_rank(summonerId, at=None, queue="RANKED_SOLO_5x5"):
+    """
+    The rank stored for a summoner as of at, or the latest one when at is None,
+    without calling the API
+    """
+    with get_cursor() as c:
+        if at is not None:
+            c.execute(
+                """
+                SELECT tier, rank FROM player_ranked_status
+                WHERE summonerId = %s AND queueType = %s AND timestamp <= %s
+                ORDER BY timestamp DESC
+                LIMIT 1
+                """,
+                (summonerId, queue, at),
+            )
+            if c.rowcount > 0:
+                return c.fetchone()
+        c.execute(
+            """
+            SELECT tier, rank FROM player_ranked_latest
+            WHERE summonerId = %s AND queueType = %s
+            """,
+            (summonerId, queue),
+        )
+        return c.fetchone()
+
+
+def get_leaderboard(guild_id, queue="RANKED_SOLO_5x5", limit=20):
+    """
+    A guild's tracked players ordered by their latest stored standing in queue
+    """
+    with get_cursor() as c:
+        c.execute(
+            """
+            SELECT ai.name, prl.tier, prl.rank, prl.leaguePoints, prl.wins, prl.losses
+            FROM player_ranked_latest prl
+            JOIN account_info ai ON ai.id = prl.summonerId
+            JOIN guild_tracked_player gtp ON gtp.puuid = ai.puuid
+            WHERE prl.queueType = %s AND gtp.guild_id = %s
+            ORDER BY prl.ladderScore DESC NULLS LAST
+            LIMIT %s
+            """,
+            (queue, guild_id, limit),
+        )
+        return c.fetchall()
+
+
+def get_climbers(guild_id, days=7, queue="RANKED_SOLO_5x5", limit=10):
+    """
+    A guild's tracked players ordered by how much ladder score they gained in the last days
+    Players with no snapshot before the window are compared to their first one in it
+    """
+    since = datetime.now() - timedelta(days=days)
+    with get_cursor() as c:
+        c.execute(
+            """
+            SELECT
+                ai.name, prl.tier, prl.rank, prl.leaguePoints,
+                prl.ladderScore - COALESCE(
+                    (
+                        SELECT prs.ladderScore FROM player_ranked_status prs
+                        WHERE prs.summonerId = prl.summonerId
+                            AND prs.queueType = prl.queueType
+                            AND prs.timestamp <= %(since)s
+                        ORDER BY prs.timestamp DESC
+                        LIMIT 1
+                    ),
+                    (
+                        SELECT prs.ladderScore FROM player_ranked_status prs
+                        WHERE prs.summonerId = prl.summonerId
+                            AND prs.queueType = prl.queueType
+                            AND prs.timestamp > %(since)s
+                        ORDER BY prs.timestamp ASC
+                        LIMIT 1
+                    )
+                ) AS climbed
+            FROM player_ranked_latest prl
+            JOIN account_info ai ON ai.id = prl.summonerId
+            JOIN guild_tracked_player gtp ON gtp.puuid = ai.puuid
+            WHERE prl.queueType = %(queue)s AND gtp.guild_id = %(guild_id)s
+            ORDER BY climbed DESC NULLS LAST
+            LIMIT %(limit)s
+            """,
+            {"since": since, "queue": queue, "guild_id": guild_id, "limit": limit},
+        )
+        return c.fetchall()
+
+
+def latest_ddragon_version():
+    response = requests.get(
+        f"{DDRAGON_BASE_URL}/api/versions.json", timeout=MATCH_FETCH_TIMEOUT
+    )
+    response.raise_for_status()
+    return json_loads(response.content)[0]
+
+
+def build_champion_atlas(directory=CHAMPION_ATLAS_DIR, version=None):
+    """
+    Download every champion icon of a Data Dragon version, the latest by default,
+    and pack them into a raw RGBA sprite atlas with a champion-id index next to it
+    """
+    logging.info("Building champion atlas")
+    version = version or latest_ddragon_version()
+    response = requests.get(
+        f"{DDRAGON_BASE_URL}/cdn/{version}/data/en_US/champion.json",
+        timeout=MATCH_FETCH_TIMEOUT,
+    )
+    response.raise_for_status()
+    champions = json_loads(response.content)["data"]
+
+    columns = 16
+    rows = -(-len(champions) // columns)
+    atlas = Image.new("RGBA", (columns * PORTRAIT_SIZE, rows * PORTRAIT_SIZE))
+    index = {}
+    for i, champion in enumerate(
+        sorted(champions.values(), key=lambda champion: int(champion["key"]))
+    ):
+        response = requests.get(
+            f"{DDRAGON_BASE_URL}/cdn/{version}/img/champion/{champion['image']['full']}",
+            timeout=MATCH_FETCH_TIMEOUT,
+        )
+        response.raise_for_status()
+        icon = Image.open(io.BytesIO(response.content)).convert("RGBA")
+        icon = icon.resize((PORTRAIT_SIZE, PORTRAIT_SIZE), Image.LANCZOS)
+        x, y = (i % columns) * PORTRAIT_SIZE, (i // columns) * PORTRAIT_SIZE
+        atlas.paste(icon, (x, y))
+        index[champion["key"]] = [x, y]
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "champions.rgba.tmp"), "wb") as f:
+        f.write(atlas.tobytes())
+    with open(os.path.join(directory, "champions.json.tmp"), "w") as f:
+        f.write(
+            json_dumps(
+                {
+                    "version": version,
+                    "size": atlas.size,
+                    "portraitSize": PORTRAIT_SIZE,
+                    "champions": index,
+                }
+            )
+        )
+    os.replace(
+        os.path.join(directory, "champions.rgba.tmp"),
+        os.path.join(directory, "champions.rgba"),
+    )
+    os.replace(
+        os.path.join(directory, "champions.json.tmp"),
+        os.path.join(directory, "champions.json"),
+    )
+    logging.info(f"Built champion atlas for {len(index)} champions ({version})")
+
+
+class ChampionAtlas:
+    """
+    Champion portraits memory-mapped from the sprite atlas built by build_champion_atlas
+    """
+
+    def __init__(self, directory=CHAMPION_ATLAS_DIR):
+        with open(os.path.join(directory, "champions.json"), "rb") as f:
+            index = json_loads(f.read())
+        self.version = index["version"]
+        self.portrait_size = index["portraitSize"]
+        self.champions = index["champions"]
+        self.missing = set()
+        with open(os.path.join(directory, "champions.rgba"), "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.image = Image.frombuffer(
+            "RGBA", tuple(index["size"]), self.buffer, "raw", "RGBA", 0, 1
+        )
+
+    def portrait(self, championId):
+        position = self.champions.get(str(championId))
+        if position is None:
+            if championId not in self.missing:
+                self.missing.add(championId)
+                logging.warn(
+                    f"Champion {championId} isn't in the {self.version} atlas, "
+                    "drawing it without a portrait"
+                )
+            return
+        x, y = position
+        return self.image.crop((x, y, x + self.portrait_size, y + self.portrait_size))
+
+
+champion_atlas = None
+
+
+def load_champion_atlas(directory=CHAMPION_ATLAS_DIR):
+    """
+    Map the champion atlas into memory, building it first if it doesn't exist yet
+    or was built for an older Data Dragon version. An existing atlas is kept
+    if the rebuild fails, cards are rendered without portraits if there is none.
+    """
+    global champion_atlas
+    try:
+        version = latest_ddragon_version()
+    except (requests.RequestException, ValueError, IndexError) as e:
+        logging.warn(f"Couldn't check the Data Dragon version: {e}")
+        version = None
+    try:
+        if os.path.exists(os.path.join(directory, "champions.json")):
+            champion_atlas = ChampionAtlas(directory)
+            if version is None or champion_atlas.version == version:
+                return
+            logging.info(f"Champion atlas is from {champion_atlas.version}")
+        build_champion_atlas(directory, version)
+        champion_atlas = ChampionAtlas(directory)
+    except (requests.RequestException, OSError, ValueError, KeyError) as e:
+        if champion_atlas:
+            logging.warn(f"Couldn't rebuild champion atlas, keeping the old one: {e}")
+        else:
+            logging.warn(
+                f"Couldn't load champion atlas, rendering without portraits: {e}"
+            )
+
+
+def get_latency_report(days=7):
+    """
+    p50/p95 seconds spent in each stage of a match's life,
+    over the matches posted in the last days
+    """
+    since = datetime.now() - timedelta(days=days)
+    stages = [
+        ("Game end → discovered", "discoveredAt - gameEndedAt"),
+        ("Discovered → fetched", "fetchedAt - discoveredAt"),
+        ("Fetched → rendered", "renderedAt - fetchedAt"),
+        ("Rendered → posted", "postedAt - renderedAt"),
+        ("Game end → posted", "postedAt - gameEndedAt"),
+    ]
+    percentile_columns = ", ".join(
+        f"percentile_cont(ARRAY[0.5, 0.95]) WITHIN GROUP (ORDER BY extract(epoch FROM {stage}))"
+        for _, stage in stages
+    )
+    with get_cursor() as c:
+        c.execute(
+            f"""
+            SELECT count(*), {percentile_columns}
+            FROM (
+                SELECT
+                    discoveredAt, fetchedAt, renderedAt, postedAt,
+                    gameStartTimestamp + make_interval(
+                        secs => (matchInfo->'info'->>'gameDuration')::int
+                    ) AS gameEndedAt
+                FROM match_info
+                WHERE postedAt > %s
+                    AND discoveredAt IS NOT NULL
+                    AND fetchedAt IS NOT NULL
+                    AND renderedAt IS NOT NULL
+            ) mi
+            """,
+            (since,),
+        )
+        count, *percentiles = c.fetchone()
+    if not count:
+        return 0, []
+    return count, [
+        (name, *(stage_percentiles or (None, None)))
+        for (name, _), stage_percentiles in zip(stages, percentiles)
+    ]
+
+
+class TextBitmapCache:
+    """
+    LRU of stroked text pre-rendered onto transparent bitmaps, bounded by their
+    total size, so a repeated string costs a paste instead of another
+    stroked rasterization
+    """
+
+    def __init__(self, max_bytes=TEXT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, text, font, anchor, fill, stroke_width, stroke_fill):
+        key = (text, anchor, font.path, font.size, fill, stroke_width, stroke_fill)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        left, top, right, bottom = font.getbbox(
+            text, anchor=anchor, stroke_width=stroke_width
+        )
+        bitmap = Image.new("RGBA", (max(right - left, 1), max(bottom - top, 1)))
+        ImageDraw.Draw(bitmap).text(
+            (-left, -top),
+            text,
+            font=font,
+            fill=fill,
+            anchor=anchor,
+            stroke_width=stroke_width,
+            stroke_fill=stroke_fill,
+        )
+        entry = (bitmap, left, top)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = entry
+                self.size += bitmap.width * bitmap.height * 4
+            while self.size > self.max_bytes:
+                evicted, _, _ = self.entries.popitem(last=False)[1]
+                self.size -= evicted.width * evicted.height * 4
+        return entry
+
+    def draw(
+        self,
+        img,
+        xy,
+        text,
+        font,
+        fill,
+        anchor="la",
+        stroke_width=0,
+        stroke_fill=None,
+        cached=True,
+    ):
+        """
+        Same as ImageDraw.text, but composited from the cache.
+        One-off strings are drawn directly with cached=False
+        so they don't evict the ones that repeat.
+        """
+        if not cached:
+            ImageDraw.Draw(img).text(
+                xy,
+                text,
+                font=font,
+                fill=fill,
+                anchor=anchor,
+                stroke_width=stroke_width,
+                stroke_fill=stroke_fill,
+            )
+            return
+        bitmap, left, top = self.get(
+            text, font, anchor, fill, stroke_width, stroke_fill
+        )
+        img.paste(bitmap, (round(xy[0]) + left, round(xy[1]) + top), bitmap)
+
+
+text_cache = TextBitmapCache()
+
+
+@cache
+def load_font(path, size):
+    return ImageFont.truetype(path, size)
+
+
+# Trimmed matchInfo holding only what build_match_embed and MatchImageCreator read,
+# so posting doesn't transfer and decode the full document
+CARD_MATCH_INFO_SQL = """
+    jsonb_build_object(
+        'metadata', jsonb_build_object('matchId', matchInfo->'metadata'->'matchId'),
+        'info', jsonb_build_object(
+            'gameCreation', matchInfo->'info'->'gameCreation',
+            'gameDuration', matchInfo->'info'->'gameDuration',
+            'queueId', matchInfo->'info'->'queueId',
+            'participants', (
+                SELECT jsonb_agg(
+                    jsonb_build_object(
+                        'puuid', p->'puuid',
+                        'summonerId', p->'summonerId',
+                        'summonerName', p->'summonerName',
+                        'championId', p->'championId',
+                        'championName', p->'championName',
+                        'teamId', p->'teamId',
+                        'win', p->'win',
+                        'kills', p->'kills',
+                        'deaths', p->'deaths',
+                        'assists', p->'assists',
+                        'totalDamageDealtToChampions', p->'totalDamageDealtToChampions'
+                    )
+                    ORDER BY i
+                )
+                FROM jsonb_array_elements(matchInfo->'info'->'participants')
+                    WITH ORDINALITY AS participants(p, i)
+            )
+        )
+    )
+"""
+
+
+class RenderCache:
+    """
+    Size-bounded on-disk store of rendered cards, evicting the least recently used.
+    Files are named by the hash of their key so the same card always lands in the same place.
+    """
+
+    def __init__(self, directory=RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_MAX_BYTES):
         self.directory = directory
-        self.filepath = None
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
 
-    def create_hashed_filename(self):
-        random_str = "".join(
-            random.choices(string.ascii_lowercase + string.digits, k=10)
+    def path_for(self, key):
+        return os.path.join(
+            self.directory, hashlib.sha256(key.encode()).hexdigest() + ".png"
         )
-        return hashlib.sha256(random_str.encode()).hexdigest() + ".png"
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            # Bump the modification time so eviction sees it as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return
+        return path
+
+    def put(self, key, img):
+        path = self.path_for(key)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        img.save(tmp_path, format="PNG")
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".png"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+render_cache = RenderCache()
+
+
+class MatchImageCreator:
+    def __init__(self, matchInfo, cache=render_cache, tracked=None):
+        self.matchInfo = matchInfo
+        self.cache = cache
+        # Only tracked players' names repeat across cards, looked up when not given
+        self.tracked = tracked
+        self.filepath = None
 
     def draw_damage_bar(
         self,
@@ -530,7 +1380,43 @@ class MatchImageCreator:
             fill=color,
         )
 
+    def fit_font(self, font_path, size, text, max_width, stroke_width):
+        """
+        The largest font no bigger than size that fits text in max_width
+        """
+        fnt = load_font(font_path, size)
+        while (
+            size > MIN_CARD_FONT_SIZE
+            and fnt.getlength(text) + 2 * stroke_width > max_width
+        ):
+            size -= 2
+            fnt = load_font(font_path, size)
+        return fnt
+
+    def draw_portrait(self, img, d, portrait, x, y):
+        img.paste(portrait, (x, y), portrait)
+        d.rectangle(
+            [x, y, x + PORTRAIT_SIZE - 1, y + PORTRAIT_SIZE - 1],
+            outline="#000000",
+            width=3,
+        )
+
+    def get_path(self):
+        """
+        Path of the rendered card, rendering it on a cache miss.
+        Blocks while rendering, run it in a thread from the event loop.
+        """
+        atlas_version = champion_atlas.version if champion_atlas else None
+        key = f"{self.matchInfo['metadata']['matchId']}:{CARD_LAYOUT_VERSION}:{atlas_version}"
+        self.filepath = self.cache.get(key)
+        if self.filepath is None:
+            self.filepath = self.cache.put(key, self.render())
+        return self.filepath
+
     def __enter__(self):
+        return self.get_path()
+
+    def render(self):
         # Create an image with desired dimensions
         background_path = os.path.join(os.getcwd(), "background.webp")
         font_path = os.path.join(os.getcwd(), "Spiegel_TT_Bold.ttf")
@@ -541,7 +1427,6 @@ class MatchImageCreator:
         red = "#8B0000"
         black = "#000000"
         stroke_width = 4
-        fnt = ImageFont.truetype(font_path, fntSize)
 
         center_x = img.width // 2 - 3
 
@@ -570,25 +1455,73 @@ class MatchImageCreator:
         )
         bar_width = 200  # Width of the damage bar
         bar_height = 20  # Height of the damage bar
+        text_offset = PORTRAIT_SIZE + 10  # Room for the champion portrait
+        margin = 10
+
+        tracked = self.tracked
+        if tracked is None:
+            tracked = find_tracked_puuids(
+                [p["puuid"] for p in self.matchInfo["info"]["participants"]]
+            )
 
         # Add player data
         for i, participant in enumerate(self.matchInfo["info"]["participants"]):
-            y = start_y + ((i % (playerCount / 2) + 1) * 3 * row_height)
+            y = start_y + ((i % (playerCount // 2) + 1) * 3 * row_height)
+            portrait = (
+                champion_atlas.portrait(participant["championId"])
+                if champion_atlas
+                else None
+            )
+            kda = f"{participant['kills']}/{participant['deaths']}/{participant['assists']}"
             if i < playerCount / 2:
-                d.text(
-                    (start_x_left, y),
+                if portrait:
+                    self.draw_portrait(
+                        img, d, portrait, start_x_left - PORTRAIT_SIZE, y
+                    )
+                text_x = start_x_left - text_offset
+                name_fnt = self.fit_font(
+                    font_path,
+                    fntSize,
+                    participant["summonerName"],
+                    text_x - margin,
+                    stroke_width,
+                )
+                text_cache.draw(
+                    img,
+                    (text_x, y),
                     participant["summonerName"],
-                    font=fnt,
-                    fill=gold,
+                    name_fnt,
+                    gold,
                     anchor="ra",
                     stroke_width=stroke_width,
                     stroke_fill=black,
+                    cached=participant["puuid"] in tracked,
                 )
-                d.text(
-                    (start_x_left, y + row_height),
-                    f"{participant['championName']} - {participant['kills']}/{participant['deaths']}/{participant['assists']}",
-                    font=fnt,
-                    fill=gold,
+                champion_fnt = self.fit_font(
+                    font_path,
+                    fntSize,
+                    f"{participant['championName']} - {kda}",
+                    text_x - margin,
+                    stroke_width,
+                )
+                # Champion names repeat across matches, cache them apart from the score
+                text_cache.draw(
+                    img,
+                    (text_x, y + row_height),
+                    f" - {kda}",
+                    champion_fnt,
+                    gold,
+                    anchor="ra",
+                    stroke_width=stroke_width,
+                    stroke_fill=black,
+                    cached=False,
+                )
+                text_cache.draw(
+                    img,
+                    (text_x - champion_fnt.getlength(f" - {kda}"), y + row_height),
+                    participant["championName"],
+                    champion_fnt,
+                    gold,
                     anchor="ra",
                     stroke_width=stroke_width,
                     stroke_fill=black,
@@ -606,19 +1539,49 @@ class MatchImageCreator:
                 )
 
             else:
-                d.text(
-                    (start_x_right, y),
+                if portrait:
+                    self.draw_portrait(img, d, portrait, start_x_right, y)
+                text_x = start_x_right + text_offset
+                name_fnt = self.fit_font(
+                    font_path,
+                    fntSize,
+                    participant["summonerName"],
+                    img.width - margin - text_x,
+                    stroke_width,
+                )
+                text_cache.draw(
+                    img,
+                    (text_x, y),
                     participant["summonerName"],
-                    font=fnt,
-                    fill=gold,
+                    name_fnt,
+                    gold,
+                    stroke_width=stroke_width,
+                    stroke_fill=black,
+                    cached=participant["puuid"] in tracked,
+                )
+                champion_fnt = self.fit_font(
+                    font_path,
+                    fntSize,
+                    f"{kda} - {participant['championName']}",
+                    img.width - margin - text_x,
+                    stroke_width,
+                )
+                text_cache.draw(
+                    img,
+                    (text_x, y + row_height),
+                    f"{kda} - ",
+                    champion_fnt,
+                    gold,
                     stroke_width=stroke_width,
                     stroke_fill=black,
+                    cached=False,
                 )
-                d.text(
-                    (start_x_right, y + row_height),
-                    f"{participant['kills']}/{participant['deaths']}/{participant['assists']} - {participant['championName']}",
-                    font=fnt,
-                    fill=gold,
+                text_cache.draw(
+                    img,
+                    (text_x + champion_fnt.getlength(f"{kda} - "), y + row_height),
+                    participant["championName"],
+                    champion_fnt,
+                    gold,
                     stroke_width=stroke_width,
                     stroke_fill=black,
                 )
@@ -634,14 +1597,12 @@ class MatchImageCreator:
                     False,
                 )
 
-        # Save the image
-        filename = self.create_hashed_filename()
-        self.filepath = os.path.join(self.directory, filename)
-        img.save(self.filepath)
-
-        return self.filepath
+        logging.debug(
+            f"Text cache hit rate {text_cache.hit_rate:.0%} "
+            f"({text_cache.hits} hits, {text_cache.misses} misses)"
+        )
+        return img
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        # Delete the file
-        if self.filepath and os.path.exists(self.filepath):
-            os.remove(self.filepath)
+        # The card is kept in the render cache for the next request
+        pass
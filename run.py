@@ -2,6 +2,7 @@ import logging
 
 from bot import bot, DISCORD_TOKEN
 from db import bootstrap_database
+from lol import load_champion_atlas
 
 # logging.basicConfig(level=logging.DEBUG)
 logging.basicConfig(level=logging.INFO)
@@ -10,4 +11,5 @@ logging.basicConfig(level=logging.INFO)
 
 if __name__ == "__main__":
     bootstrap_database()
+    load_champion_atlas()
     bot.run(DISCORD_TOKEN)
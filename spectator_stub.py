@@ -0,0 +1,59 @@
+"""
+Local stand-in for spectator-v5 to exercise live game tracking without Riot
+
+    python spectator_stub.py --games games.json --port 8099
+    SPECTATOR_BASE_URL=http://localhost:8099 LIVE_GAME_TRACKING=1 python run.py
+
+games.json maps puuids to the game they are in, e.g.
+{"<puuid>": {"gameId": 4900000000, "platformId": "NA1"}}.
+It is re-read on every request, so removing a player's entry ends their game.
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+
+from dankutil import json_dumps, json_loads
+
+ACTIVE_GAME_PATH = "/lol/spectator/v5/active-games/by-summoner/"
+
+
+def make_handler(games_path):
+    class SpectatorHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not self.path.startswith(ACTIVE_GAME_PATH):
+                self.respond(404, {"status": {"status_code": 404}})
+                return
+
+            puuid = self.path[len(ACTIVE_GAME_PATH) :]
+            try:
+                with open(games_path, "rb") as f:
+                    games = json_loads(f.read())
+            except FileNotFoundError:
+                games = {}
+            if puuid in games:
+                self.respond(200, {"participants": [{"puuid": puuid}], **games[puuid]})
+            else:
+                self.respond(404, {"status": {"status_code": 404}})
+
+        def respond(self, status, body):
+            payload = json_dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return SpectatorHandler
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--games", default="games.json")
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+
+    logging.info(f"Serving spectator stand-in on port {args.port} from {args.games}")
+    ThreadingHTTPServer(("", args.port), make_handler(args.games)).serve_forever()
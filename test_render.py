@@ -0,0 +1,88 @@
+import os
+
+from PIL import Image
+
+import lol
+from dankutil import json_dumps
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def write_atlas(directory, championIds):
+    size = lol.PORTRAIT_SIZE
+    atlas = Image.new("RGBA", (len(championIds) * size, size), "#0080FF")
+    with open(os.path.join(directory, "champions.rgba"), "wb") as f:
+        f.write(atlas.tobytes())
+    with open(os.path.join(directory, "champions.json"), "w") as f:
+        f.write(
+            json_dumps(
+                {
+                    "version": "test",
+                    "size": atlas.size,
+                    "portraitSize": size,
+                    "champions": {
+                        str(championId): [i * size, 0]
+                        for i, championId in enumerate(championIds)
+                    },
+                }
+            )
+        )
+
+
+def make_match(champions):
+    return {
+        "metadata": {"matchId": "NA1_1"},
+        "info": {
+            "participants": [
+                {
+                    "puuid": f"puuid-{i}",
+                    "summonerName": "xXLongSummonerNameXx",
+                    "championId": championId,
+                    "championName": championName,
+                    "teamId": 100 if i < len(champions) // 2 else 200,
+                    "win": i < len(champions) // 2,
+                    "kills": 12,
+                    "deaths": 10,
+                    "assists": 18,
+                    "totalDamageDealtToChampions": 1000 * (i + 1),
+                }
+                for i, (championId, championName) in enumerate(champions)
+            ]
+        },
+    }
+
+
+def test_render_with_champion_atlas(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+    write_atlas(tmp_path, [20, 21])
+    monkeypatch.setattr(lol, "champion_atlas", lol.ChampionAtlas(tmp_path))
+    match = make_match([(20, "Nunu & Willump"), (21, "Miss Fortune")] * 5)
+
+    creator = lol.MatchImageCreator(
+        match, cache=lol.RenderCache(tmp_path / "render_cache"), tracked={"puuid-0"}
+    )
+    path = creator.get_path()
+
+    with Image.open(path) as img:
+        assert img.size == Image.open(os.path.join(REPO_DIR, "background.webp")).size
+        # The first blue team portrait sits just left of the center line
+        center_x = img.width // 2 - 3
+        x = center_x - 10 - lol.PORTRAIT_SIZE // 2
+        y = 10 + 3 * 50 + lol.PORTRAIT_SIZE // 2
+        assert img.convert("RGB").getpixel((x, y)) == (0, 128, 255)
+
+
+def test_text_cache_is_bounded_by_bytes(monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+    fnt = lol.load_font(os.path.join(REPO_DIR, "Spiegel_TT_Bold.ttf"), 40)
+    cache = lol.TextBitmapCache(max_bytes=100 * 1024)
+    img = Image.new("RGBA", (1024, 128))
+    for i in range(20):
+        cache.draw(img, (0, 0), f"Champion {i}", fnt, "#C89B3C", stroke_width=4)
+        assert cache.size <= cache.max_bytes
+    cache.draw(img, (0, 0), "Champion 19", fnt, "#C89B3C", stroke_width=4)
+    cache.draw(img, (0, 0), "0/0/0", fnt, "#C89B3C", stroke_width=4, cached=False)
+    assert (cache.hits, cache.misses) == (1, 20)
+    assert cache.size == sum(
+        bitmap.width * bitmap.height * 4 for bitmap, _, _ in cache.entries.values()
+    )